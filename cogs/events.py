@@ -2,7 +2,7 @@ import contextlib
 
 import discord
 
-from discord.ext import commands
+from discord.ext import commands, tasks
 from main import Ayane
 from private.config import DEFAULT_PREFIXES
 
@@ -16,11 +16,14 @@ class Events(commands.Cog):
         self.bot: Ayane = bot
         self.emoji = '⚙'
         self.brief = 'Ayane Internal Stuff'
+        self.leave_sus_guilds.start()
+
+    def cog_unload(self):
+        self.leave_sus_guilds.cancel()
 
     @commands.Cog.listener("on_app_command_completion")
     async def on_app_command_completion(self, interaction, command) -> None:
-        await interaction.client.pool.execute(
-            "INSERT INTO commands (guild_id, user_id, command, timestamp) VALUES ($1, $2, $3, $4)",
+        await interaction.client.command_writer.add(
             getattr(interaction.guild, "id", None),
             interaction.user.id,
             command.qualified_name,
@@ -29,8 +32,7 @@ class Events(commands.Cog):
 
     @commands.Cog.listener("on_command")
     async def basic_command_logger(self, ctx):
-        await self.bot.pool.execute(
-            "INSERT INTO commands (guild_id, user_id, command, timestamp) VALUES ($1, $2, $3, $4)",
+        await self.bot.command_writer.add(
             getattr(ctx.guild, "id", None),
             ctx.author.id,
             ctx.command.qualified_name,
@@ -50,19 +52,63 @@ class Events(commands.Cog):
                     mention_author=False
                 )
 
+    @commands.Cog.listener("on_ready")
+    async def build_indexes(self):
+        guilds = self.bot.guilds
+        self.bot.population.rebuild(guilds)
+        self.bot.statistics.rebuild(guilds)
+
+    @commands.Cog.listener("on_member_join")
+    async def index_member_join(self, member):
+        self.bot.population.member_join(member)
+        self.bot.statistics.member_join(member)
+
+    @commands.Cog.listener("on_member_remove")
+    async def index_member_remove(self, member):
+        self.bot.population.member_remove(member)
+        self.bot.statistics.member_remove(member)
+
+    @commands.Cog.listener("on_guild_channel_create")
+    async def index_channel_create(self, channel):
+        self.bot.statistics.add_channel(channel)
+
+    @commands.Cog.listener("on_guild_channel_delete")
+    async def index_channel_delete(self, channel):
+        self.bot.statistics.remove_channel(channel)
+
+    @commands.Cog.listener("on_guild_channel_update")
+    async def index_channel_update(self, before, after):
+        self.bot.statistics.update_channel(before, after)
+
+    @tasks.loop(hours=1)
+    async def leave_sus_guilds(self):
+        if not self.bot.auto_leave_sus_guilds:
+            return
+        for guild in self.bot.get_sus_guilds():
+            with contextlib.suppress(discord.HTTPException):
+                await guild.leave()
+
+    @leave_sus_guilds.before_loop
+    async def before_leave_sus_guilds(self):
+        await self.bot.wait_until_ready()
+
     def format_log_embed(self, guild, title, who_added=None, invite=None):
         embed = discord.Embed(timestamp=discord.utils.utcnow(), colour=self.bot.colour, title=title)
-        guild_bots = [m for m in guild.members if m.bot]
-        guild_humans = [m for m in guild.members if not m.bot]
         if guild.icon:
             embed.set_thumbnail(url=guild.icon.url)
         embed.add_field(name="Name", value=guild.name, inline=False)
         embed.add_field(name="ID", value=str(guild.id), inline=False)
-        embed.add_field(name="Owner", value=str(guild.owner) + " | " + str(guild.owner.id), inline=False)
-        embed.add_field(name="Members", value=len(guild.members), inline=False)
-        embed.add_field(name="Bots", value=len(guild_bots), inline=False)
-        embed.add_field(name="Humans", value=len(guild_humans), inline=False)
-        embed.add_field(name="Bots/Humans", value=round(len(guild_bots) / len(guild_humans), 2), inline=False)
+        embed.add_field(name="Owner", value=(str(guild.owner) + " | " if guild.owner else "") + str(guild.owner_id),
+                        inline=False)
+        if guild.id in self.bot.population:
+            guild_bots, guild_humans = self.bot.population.get(guild.id)
+            embed.add_field(name="Members", value=guild_bots + guild_humans, inline=False)
+            embed.add_field(name="Bots", value=guild_bots, inline=False)
+            embed.add_field(name="Humans", value=guild_humans, inline=False)
+            embed.add_field(name="Bots/Humans", value=round(guild_bots / max(guild_humans, 1), 2), inline=False)
+        else:
+            # Not chunked, only the member count is known.
+            embed.add_field(name="Members", value=guild.member_count, inline=False)
         if invite:
             embed.add_field(name="Invite", value=f'[{invite.code}]({invite.url})')
         if who_added:
@@ -71,6 +117,8 @@ class Events(commands.Cog):
 
     @commands.Cog.listener("on_guild_join")
     async def on_guild_join(self, guild):
+        self.bot.population.add_guild(guild)
+        self.bot.statistics.add_guild(guild)
         who_added = None
         invite = None
         try:
@@ -89,10 +137,13 @@ class Events(commands.Cog):
             pass
         embed = self.format_log_embed(guild, "I joined a new Guild", who_added=who_added, invite=invite)
         if self.bot.log_channel_id:
-            await self.bot.get_channel(self.bot.log_channel_id).send(embed=embed)
+            await self.bot.get_partial_messageable(self.bot.log_channel_id).send(embed=embed)
 
     @commands.Cog.listener("on_guild_remove")
     async def on_guild_remove(self, guild):
+        self.bot.guild_settings.discard(guild.id)
         embed = self.format_log_embed(guild, "I was removed from a Guild")
+        self.bot.population.remove_guild(guild.id)
+        self.bot.statistics.remove_guild(guild)
         if self.bot.log_channel_id:
-            await self.bot.get_channel(self.bot.log_channel_id).send(embed=embed)
+            await self.bot.get_partial_messageable(self.bot.log_channel_id).send(embed=embed)
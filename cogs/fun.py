@@ -1,16 +1,23 @@
+import logging
+
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 from discord import app_commands
 
 from main import Ayane
+from utils.cache import RevalidatingCache
 from utils.paginators import BaseSource, ViewMenu
 from utils.helpers import stop_if_nsfw
+from utils.singleflight import make_key
+from utils.titles import TitleIndex
 
 import kadal
 # fork at https://github.com/Bucolo/Kadal/
 import re
 from dateutil.parser import parse
 
+log = logging.getLogger(__name__)
+
 
 async def setup(bot):
     await bot.add_cog(Fun(bot))
@@ -29,6 +36,75 @@ class Fun(commands.Cog):
         self.brief = 'Some fun commands'
         self.bot: Ayane = bot
         self.kadalclient = kadal.Client(session=self.bot.session)
+        # AniList search results by normalized query, served stale for a day while they are refreshed.
+        self.anilist_cache = RevalidatingCache(max_age=3600.0, max_stale=86400.0, max_size=2000)
+        # (media type, adult) -> the rendered embeds of the top 50, refreshed every hour.
+        self.top_lists = {}
+        # The titles of the medias seen in the searches and top lists, for the autocomplete of /anime and /manga.
+        self.title_index = dict(ANIME=TitleIndex(), MANGA=TitleIndex())
+
+    async def cog_load(self):
+        self.refresh_top_lists.start()
+
+    async def cog_unload(self):
+        self.refresh_top_lists.cancel()
+
+    def resolve_media_id(self, name, media_type):
+        """The media id picked in the autocomplete, or of a title only one known media has."""
+        if name.startswith("id:") and name[3:].isdigit():
+            return int(name[3:])
+        return self.title_index[media_type].exact(name)
+
+    async def search(self, name, media_type):
+        media_id = self.resolve_media_id(name, media_type)
+        if media_id is not None:
+            key = make_key(f"anilist {media_type.lower()} id", id=media_id)
+            get = self.kadalclient.get_anime if media_type == "ANIME" else self.kadalclient.get_manga
+            factory = lambda: get(media_id)
+        else:
+            key = make_key(f"anilist {media_type.lower()}", name=name)
+            search = self.kadalclient.search_anime if media_type == "ANIME" else self.kadalclient.search_manga
+            factory = lambda: search(name, popularity=True, allow_adult=True)
+        return await self.anilist_cache.get(key, lambda: self.fetch_media(media_type, factory, key))
+
+    async def fetch_media(self, media_type, factory, key):
+        media = await self.bot.anilist_gateway.call(factory, key=key)
+        self.title_index[media_type].add(media)
+        return media
+
+    def title_choices(self, interaction, current, media_type):
+        nsfw_channel = interaction.channel.is_nsfw() if not isinstance(interaction.channel, discord.DMChannel) else False
+        return [
+            app_commands.Choice(name=display[:100], value=f"id:{media_id}")
+            for media_id, display in self.title_index[media_type].search(current, allow_adult=nsfw_channel)
+        ]
+
+    async def fetch_top_list(self, media_type, adult):
+        variables = {"type": media_type, "sort": "SCORE_DESC", "isAdult": adult}
+        medias = await self.bot.anilist_gateway.call(
+            lambda: self.kadalclient.custom_paged_search(**variables),
+            key=make_key("anilist paged search", **variables),
+        )
+        for media in medias:
+            self.title_index[media_type].add(media)
+        embeds = [self.format_anilist_embeds(media, index=i + 1, total=len(medias)) for i, media in enumerate(medias)]
+        self.top_lists[media_type, adult] = embeds
+        return embeds
+
+    async def get_top_list(self, media_type, adult):
+        embeds = self.top_lists.get((media_type, adult))
+        if embeds is None:
+            embeds = await self.fetch_top_list(media_type, adult)
+        return embeds
+
+    @tasks.loop(hours=1)
+    async def refresh_top_lists(self):
+        for media_type in ("ANIME", "MANGA"):
+            for adult in (False, True):
+                try:
+                    await self.fetch_top_list(media_type, adult)
+                except Exception as e:
+                    log.warning(f"Could not refresh the AniList top {media_type.lower()} list: {e!r}")
 
     @staticmethod
     def format_error_message(search, safe_search=False):
@@ -76,39 +152,42 @@ class Fun(commands.Cog):
         """Search an anime on https://anilist.co"""
         nsfw_channel = interaction.channel.is_nsfw() if not isinstance(interaction.channel, discord.DMChannel) else False
         try:
-            anime = await self.kadalclient.search_anime(name, popularity=True, allow_adult=True)
+            anime = await self.search(name, "ANIME")
         except kadal.MediaNotFound:
             return await interaction.response.send_message(self.format_error_message(name))
         stop_if_nsfw(anime.is_adult and not nsfw_channel)
         await interaction.response.defer(thinking=True)
         await interaction.followup.send(embed=self.format_anilist_embeds(anime))
 
+    @anime_.autocomplete('name')
+    async def anime_autocomplete(self, interaction, current: str):
+        return self.title_choices(interaction, current, "ANIME")
+
     @app_commands.command(name='manga')
     @app_commands.describe(name='The name of the manga you want to search')
     async def manga_(self, interaction, name: str) -> discord.Message:
         """Search a manga on https://anilist.co"""
         nsfw_channel = interaction.channel.is_nsfw() if not isinstance(interaction.channel, discord.DMChannel) else False
         try:
-            manga = await self.kadalclient.search_manga(name, popularity=True, allow_adult=True)
+            manga = await self.search(name, "MANGA")
         except kadal.MediaNotFound:
             return await interaction.response.send_message(self.format_error_message(name))
         stop_if_nsfw(manga.is_adult and not nsfw_channel)
         await interaction.response.defer(thinking=True)
         await interaction.followup.send(embed=self.format_anilist_embeds(manga))
 
+    @manga_.autocomplete('name')
+    async def manga_autocomplete(self, interaction, current: str):
+        return self.title_choices(interaction, current, "MANGA")
+
     @app_commands.command(name='top-manga')
     @app_commands.describe(adult='If you want or not to retrieve adult only mangas')
     async def top_manga_(self, interaction, adult: bool = False):
         """Get the top 50 manga on https://anilist.co"""
         nsfw_channel = interaction.channel.is_nsfw() if not isinstance(interaction.channel, discord.DMChannel) else False
         stop_if_nsfw(adult and not nsfw_channel)
-        embed_list = []
-        variables = {"type": "MANGA", "sort": "SCORE_DESC"}
-        variables["isAdult"] = adult
-        allmangas = await self.kadalclient.custom_paged_search(**variables)
-        for i, manga in enumerate(allmangas):
-            embed_list.append(self.format_anilist_embeds(manga, index=i + 1, total=len(allmangas)))
         await interaction.response.defer(thinking=True)
+        embed_list = await self.get_top_list("MANGA", adult)
         await ViewMenu(source=BaseSource(embed_list, per_page=1), main_interaction=interaction).start()
 
     @app_commands.command(name='top-anime')
@@ -118,11 +197,6 @@ class Fun(commands.Cog):
         Safe search is forced if not in nsfw channel"""
         nsfw_channel = interaction.channel.is_nsfw() if not isinstance(interaction.channel, discord.DMChannel) else False
         stop_if_nsfw(adult and not nsfw_channel)
-        embed_list = []
-        variables = {"type": "ANIME", "sort": "SCORE_DESC"}
-        variables["isAdult"] = adult
-        allanimes = await self.kadalclient.custom_paged_search(**variables)
-        for i, anime in enumerate(allanimes):
-            embed_list.append(self.format_anilist_embeds(anime, index=i + 1, total=len(allanimes)))
         await interaction.response.defer(thinking=True)
+        embed_list = await self.get_top_list("ANIME", adult)
         await ViewMenu(source=BaseSource(embed_list, per_page=1), main_interaction=interaction).start()
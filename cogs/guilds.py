@@ -18,10 +18,17 @@ class Guilds(commands.Cog):
 
     @tasks.loop(seconds=5.0)
     async def automove(self):
+        target_category = self.bot.get_channel(self.automove_target_category)
+        if target_category is None:
+            # The guild is handled by another cluster.
+            return
         for s in self.automove_source_channels:
-            for m in self.bot.get_channel(s).members:
+            source = self.bot.get_channel(s)
+            if source is None:
+                continue
+            for m in source.members:
                 for channel in [
-                    i for i in self.bot.get_channel(self.automove_target_category).channels
+                    i for i in target_category.channels
                     if isinstance(i, discord.VoiceChannel)
                 ]:
                     if len(channel.members) > 0:
@@ -22,20 +22,7 @@ class Info(commands.Cog):
     @app_commands.command(name='about')
     async def about(self, interaction):
         """Some information about the bot like the bot owners, statistics etc."""
-        text_channel = 0
-        voice_channel = 0
-        stage_channel = 0
-
-        for channel in self.bot.get_all_channels():
-            if isinstance(channel, discord.TextChannel):
-                text_channel += 1
-
-            elif isinstance(channel, discord.VoiceChannel):
-                voice_channel += 1
-
-            elif isinstance(channel, discord.StageChannel):
-                stage_channel += 1
-
+        stats = self.bot.statistics.snapshot()
         embed = discord.Embed(
             title="Information about the bot",
             color=self.bot.colour,
@@ -47,13 +34,17 @@ class Info(commands.Cog):
             value=f"Owners : {' '.join([f'`{self.bot.get_user(owner)}`' for owner in self.bot.owner_ids])}\n",
             inline=False,
         )
+        statistics = "<:stats:846407087491121224> Statistics"
+        if self.bot.cluster_label:
+            # Every cluster only knows the guilds of its own shards.
+            statistics += f" ({self.bot.cluster_label})"
         embed.add_field(
-            name="<:stats:846407087491121224> Statistics",
-            value=f"\n<:servers:846407428152492122> Servers : `{len(self.bot.guilds)}`"
-                  f"\n<:users:846407378047729676> Users : `{len(self.bot.users)}`"
-                  f"\n<:text_channel:846407318982885435> Text channels : `{text_channel}`"
-                  f"\n<:voice_channel:846407273718743080> Voice channels : `{voice_channel}`"
-                  f"\n<:stage_channel:846410090050879529> Stage channels : `{stage_channel}`"
+            name=statistics,
+            value=f"\n<:servers:846407428152492122> Servers : `{stats['guilds']}`"
+                  f"\n<:users:846407378047729676> Users : `{stats['users']}`"
+                  f"\n<:text_channel:846407318982885435> Text channels : `{stats['text_channels']}`"
+                  f"\n<:voice_channel:846407273718743080> Voice channels : `{stats['voice_channels']}`"
+                  f"\n<:stage_channel:846410090050879529> Stage channels : `{stats['stage_channels']}`"
                   f"\n<:bot_commands:846415723798462464> Commands : `{len(self.bot.commands) + len(self.bot.tree.get_commands())}`",
             inline=False,
         )
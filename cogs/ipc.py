@@ -25,12 +25,22 @@ class IPC(commands.Cog):
         return web.json_response(
             dict(id=user.id, name=user.name, full_name=str(user), avatar_url=user.display_avatar.url))
 
+    async def stats_handler(self, request):
+        # The statistics of this cluster only, the totals are the sum over the IPC servers of every cluster.
+        return web.json_response(dict(
+            cluster_id=self.bot.cluster_id,
+            shard_ids=self.bot.shard_ids,
+            shard_count=self.bot.shard_count,
+            **self.bot.statistics.snapshot(),
+        ))
+
     async def run(self):
         await self.bot.wait_until_ready()
         self.bot.server.router.add_get("/userinfo/", self.user_info_handler)
+        self.bot.server.router.add_get("/stats/", self.stats_handler)
         runner = web.AppRunner(self.bot.server)
         await runner.setup()
-        self._webserver = web.TCPSite(runner, "127.0.0.1", "8033")
+        self._webserver = web.TCPSite(runner, "127.0.0.1", 8033 + self.bot.cluster_id)
         await self._webserver.start()
         print("Starting IPC server")
 
@@ -12,6 +12,7 @@ from main import Ayane
 from utils.cache import ExpiringCache
 from utils.exceptions import AlreadyMuted, NotMuted
 from utils.mods import ModUtils
+from utils.settings import MISSING
 from private.config import LOCAL
 
 
@@ -32,8 +33,8 @@ class AntiSpam:
 
     def __init__(self):
         self.modutils = ModUtils()
-        # A 30 min cache for user that joined 'together'
-        self.fast_followed_joiners = ExpiringCache(seconds=1800.0)
+        # A 30 min cache for user that joined 'together', bounded so a raid cannot make it grow forever
+        self.fast_followed_joiners = ExpiringCache(seconds=1800.0, max_size=5000)
         # The date and id of the last joiner (to determine whether they are 'fast followed users')
         self.last_joiner = None
         self.escaped_first_joiner = None
@@ -66,7 +67,7 @@ class AntiSpam:
             self.escaped_first_joiner = member.id
         elif (member.joined_at - self.last_joiner.joined_at).total_seconds() <= 3.0:
             if self.escaped_first_joiner:
-                self.fast_followed_joiners[self.escaped_first_joiner.id] = True
+                self.fast_followed_joiners[self.escaped_first_joiner] = True
             self.fast_followed_joiners[member.id] = is_fast = True
             self.escaped_first_joiner = None
         return is_fast
@@ -132,23 +133,31 @@ class Moderator(commands.Cog):
         # We use defaultdict because it's faster than using setdefault each time.
         self.modutils = ModUtils()
         self.antispam = defaultdict(AntiSpam)
+        # The running chunk requests of the guilds that just turned the anti-spam on.
+        self.chunk_tasks = set()
 
-    async def get_guild_mod(self, guild_id):
-        return await self.bot.pool.fetchval("SELECT anti_spam_mode FROM registered_guild WHERE id=$1", guild_id)
+    async def chunk_guild(self, guild):
+        await guild.chunk()
+        self.bot.population.add_guild(guild)
 
     @commands.Cog.listener("on_message")
     async def on_message_event(self, message):
-        if not message.guild:
+        if LOCAL or not message.guild:
+            return
+        if message.author.bot:
             return
         if message.author.id in {self.bot.owner_id, *self.bot.owner_ids}:
             return
         if not isinstance(message.author, discord.Member):
             return
-        if message.author.bot:
+        # Most guilds have the anti-spam disabled, they are settled from the cache without awaiting anything.
+        guild_mode = self.bot.guild_settings.get_anti_spam_mode(message.guild.id)
+        if guild_mode is MISSING:
+            guild_mode = await self.bot.guild_settings.fetch_anti_spam_mode(message.guild.id)
+        if guild_mode is None:
             return
-        if not LOCAL:
-            guild_mode = await self.get_guild_mod(message.guild.id)
-            await self.antispam[message.guild.id].sanction_if_spamming(message, guild_mode)
+        self.modutils.activity.record(message)
+        await self.antispam[message.guild.id].sanction_if_spamming(message, guild_mode)
 
     @app_commands.command(name="antispam")
     @app_commands.describe(mode="The antispam mode that you want to set.")
@@ -163,13 +172,13 @@ class Moderator(commands.Cog):
         default to disabled."""
         if mode == "disabled":
             mode = None
-        await self.bot.pool.execute(
-            "INSERT INTO registered_guild (id,name,anti_spam_mode)"
-            "VALUES ($1,$2,$3) ON CONFLICT (id) DO UPDATE SET name=$2,anti_spam_mode=$3",
-            interaction.guild.id,
-            interaction.guild.name,
-            mode,
-        )
+        await self.bot.guild_settings.set_anti_spam_mode(interaction.guild, mode)
+        if not mode:
+            self.modutils.activity.stop(interaction.guild.id)
+        if mode and self.bot.profile.lazy_chunking and not interaction.guild.chunked:
+            task = self.bot.loop.create_task(self.chunk_guild(interaction.guild))
+            self.chunk_tasks.add(task)
+            task.add_done_callback(self.chunk_tasks.discard)
         await interaction.response.send_message(f"The antispam mode is now set to `{mode if mode else 'disabled'}`.")
 
     @app_commands.command(name="ban")
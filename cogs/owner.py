@@ -37,6 +37,57 @@ class Owner(commands.Cog):
         await ctx.send("Restarting the bot...")
         await ctx.bot.close()
 
+    @dev.command(name='blacklist-sync', aliases=['bls'], message_command=True)
+    async def dev_blacklist_sync(self, ctx: AyaneContext):
+        count = await self.bot.blacklist.sync()
+        await ctx.send(f"Blacklist resynced, **{count}** users are blacklisted.")
+
+    @dev.command(name='metrics', aliases=['m'], message_command=True)
+    async def dev_metrics(self, ctx: AyaneContext):
+        sections = {
+            'Runtime': self.bot.startup_report,
+            'Usage writer': self.bot.command_writer.stats(),
+            'Guild settings cache': self.bot.guild_settings.stats(),
+            'User locks': self.bot.user_lock.stats(),
+            'Error reports': self.bot.error_reporter.stats(),
+            'Single-flight': self.bot.single_flight.stats(),
+            'waifu.im gateway': self.bot.waifu_gateway.stats(),
+            'AniList gateway': self.bot.anilist_gateway.stats(),
+            'Favorites cache': self.bot.favorites.stats(),
+            'Stateless menus': self.bot.paginator_dispatcher.stats(),
+            'Live views': self.bot.views.stats(),
+            'waifu.im metadata': self.bot.get_cog('Waifu').metadata.stats() if self.bot.get_cog('Waifu') else None,
+            'AniList cache': self.bot.get_cog('Fun').anilist_cache.stats() if self.bot.get_cog('Fun') else None,
+            'Prefetch pools': self.bot.waifu_pool.stats() if hasattr(self.bot, 'waifu_pool') else None,
+        }
+        embed = discord.Embed(title="Metrics")
+        for name, stats in sections.items():
+            if not stats:
+                continue
+            embed.add_field(name=name, value='\n'.join(f"{key.capitalize()} : `{value}`" for key, value in stats.items()))
+        await ctx.send(embed=embed)
+
+    @dev.command(name='locks', aliases=['l'], message_command=True)
+    async def dev_locks(self, ctx: AyaneContext, min_seconds: float = 60.0):
+        locks = self.bot.user_lock.held(min_seconds)
+        if not locks:
+            return await ctx.send(f"No user lock has been held for more than {min_seconds}s.")
+        lines = [f"`{lock.user}` ({lock.user.id}) : held for `{lock.held_for or 0.0:.0f}s`" for lock in locks[:20]]
+        if len(locks) > 20:
+            lines.append(f"... and {len(locks) - 20} more.")
+        await ctx.send('\n'.join(lines))
+
+    @dev.command(name='prefetch', aliases=['pf'], message_command=True)
+    async def dev_prefetch(self, ctx: AyaneContext):
+        stats = self.bot.waifu_pool.key_stats()
+        if not stats:
+            return await ctx.send("No image has been requested from the prefetch pools yet.")
+        lines = [
+            f"`{tag}` nsfw={is_nsfw} gif={is_gif} : hit rate `{s['hit_rate']:.0%}`, `{s['size']}` pooled"
+            for (tag, is_nsfw, is_gif), s in list(stats.items())[:20]
+        ]
+        await ctx.send('\n'.join(lines))
+
     Status = typing.Literal['playing', 'streaming', 'listening', 'watching', 'competing']
 
     @dev.command(name='status', aliases=['ss'], message_command=True)
@@ -4,17 +4,34 @@ import time
 import waifuim
 import xxhash
 import asyncio
+import aiohttp
+import logging
+from collections import Counter
 
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 from discord import app_commands
 
 from utils import exceptions
+from utils.autocomplete import AutocompleteIndex
+from utils.cache import ExpiringCache
 from utils.helpers import stop_if_nsfw
-from utils.paginators import ImageMenu, FavMenu, ImageSource
+from utils.paginators import ImageMenu, FavMenu, ImageSource, StatelessImageMenu, favorites_title
+from utils.prefetch import PrefetchPool
+from utils.singleflight import make_key
+from utils.waifu_meta import WaifuImMetadata, client_headers
+
+log = logging.getLogger(__name__)
 
 
 class PictureConverter:
+    # The images are streamed through the hasher, bigger ones are not hashed and slow hosts are given up on.
+    max_size = 20 * 1024 * 1024
+    chunk_size = 64 * 1024
+    timeout = aiohttp.ClientTimeout(total=15)
+    # url or attachment id -> xxh3 digest of the image, None if it was not an image or too big.
+    digests = ExpiringCache(seconds=3600.0, max_size=2048)
+
     def __init__(self, bot, file_string=None, file=None):
         self.file_string = file_string
         self.file = file
@@ -26,42 +43,66 @@ class PictureConverter:
         self.bot = bot
         self.is_url = None
 
+    async def hash_image(self, url, headers=None):
+        async with self.bot.session.get(url, headers=headers, timeout=self.timeout) as rep:
+            if "image" not in rep.headers.get("content-type", ""):
+                return None
+            if (rep.content_length or 0) > self.max_size:
+                return None
+            hasher = xxhash.xxh3_64()
+            size = 0
+            async for chunk in rep.content.iter_chunked(self.chunk_size):
+                size += len(chunk)
+                if size > self.max_size:
+                    return None
+                hasher.update(chunk)
+            return hasher.hexdigest()
+
+    async def cached_digest(self, key, url, headers=None):
+        try:
+            return self.digests[key]
+        except KeyError:
+            pass
+        digest = self.digests[key] = await self.hash_image(url, headers=headers)
+        return digest
+
     async def clean(self):
         if self.file:
-            return os.path.splitext(xxhash.xxh3_64_hexdigest(await self.file.read()))[0]
+            filename = os.path.splitext(self.file.filename)[0]
+            if self.file.size > self.max_size:
+                return filename
+            try:
+                return await self.cached_digest(self.file.id, self.file.url) or filename
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                return filename
         filename = self.maybe_id
         try:
-            rep = await self.bot.session.get(
-                self.file_string, headers={"Referer": "https://pixiv.net"}
+            digest = await self.cached_digest(
+                self.file_string, self.file_string, headers={"Referer": "https://pixiv.net"}
             )
-            if "image" in rep.headers.get("content-type", ""):
-                content = await rep.read()
-                filename = xxhash.xxh3_64_hexdigest(content)
+            if digest:
+                filename = digest
                 self.is_url = True
-        except:
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
             pass
         return filename
 
 
+def copy_results(images):
+    """Each paginator removes images from its own list, so callers sharing a result each get a copy of it."""
+    return list(images) if isinstance(images, list) else images
+
+
 async def nsfw_tag_autocomplete(interaction, current):
-    return [
-        app_commands.Choice(name=tag.capitalize(), value=tag)
-        for tag in interaction.client.waifu_im_tags['nsfw'] if current.lower() in tag.lower()
-    ]
+    return interaction.client.waifu_im_autocomplete['nsfw'].search(current)
 
 
 async def sfw_tag_autocomplete(interaction, current):
-    return [
-        app_commands.Choice(name=tag.capitalize(), value=tag)
-        for tag in interaction.client.waifu_im_tags['sfw'] if current.lower() in tag.lower()
-    ]
+    return interaction.client.waifu_im_autocomplete['sfw'].search(current)
 
 
 async def order_by_autocomplete(interaction, current):
-    return [
-        app_commands.Choice(name=type_.upper(), value=type_)
-        for type_ in interaction.client.waifu_im_order_by if current.lower() in type_.lower()
-    ]
+    return interaction.client.waifu_im_autocomplete['order_by'].search(current)
 
 
 async def setup(bot):
@@ -76,37 +117,71 @@ class Waifu(commands.Cog):
         self.emoji = '<:ty:833356132075700254>'
         self.brief = 'The bot waifu API commands and some others.'
         self.bot.waifu_reason_exempted_users = {747737674952999024}
+        self.metadata = WaifuImMetadata(self.bot.session, gateway=self.bot.waifu_gateway,
+                                        headers=client_headers(self.bot.waifu_client))
+        # How many times each tag and order_by has been requested, used to rank the autocomplete choices.
+        self.bot.waifu_im_popularity = Counter()
+        # Random images pre-fetched per (tag, is_nsfw, is_gif) for `/waifu sfw` and `/waifu nsfw`.
+        self.bot.waifu_pool = PrefetchPool(self.fetch_random_batch)
+
+    async def fetch_random_batch(self, key):
+        tag, is_nsfw, is_gif = key
+        images = await self.bot.waifu_gateway.call(
+            lambda: self.bot.waifu_client.search(included_tags=[tag], is_nsfw=is_nsfw, gif=is_gif, many=True)
+        )
+        return images if isinstance(images, list) else [images]
 
     async def not_empty(self, tag, is_nsfw):
         try:
-            return bool(await self.bot.waifu_client.search(is_nsfw=is_nsfw, included_tags=[tag]))
+            return bool(await self.bot.waifu_gateway.call(
+                lambda: self.bot.waifu_client.search(is_nsfw=is_nsfw, included_tags=[tag]),
+                key=make_key("waifu.im search", is_nsfw=is_nsfw, included_tags=[tag]),
+            ))
         except waifuim.APIException as e:
-            if e.status == 429:
-                await asyncio.sleep(0.25)
-                return await self.not_empty(tag, is_nsfw)
-            elif e.status != 404:
-                # We allow the tag even if it will error at least the user will get some traceback
-                return True
+            # The gateway already retried the 429s. We allow the tag even if it will error at least the user will
+            # get some traceback
+            return e.status != 404
 
     async def cog_load(self):
+        # Serve the copy saved on disk (or the fallbacks) until the warm-up fetched the real values, so neither the
+        # startup nor the autocomplete ever wait for waifu.im
+        self.metadata.load()
+        self.swap_metadata()
+        self.bot.warm_up("waifu.im", self.warm_up_metadata())
+
+    async def cog_unload(self):
+        self.refresh_metadata.cancel()
+
+    def swap_metadata(self):
+        if self.bot.waifu_im_tags is self.metadata.tags and self.bot.waifu_im_order_by is self.metadata.order_by:
+            return
+        self.bot.waifu_im_autocomplete = dict(
+            sfw=AutocompleteIndex(self.metadata.tags['sfw'], popularity=self.bot.waifu_im_popularity),
+            nsfw=AutocompleteIndex(self.metadata.tags['nsfw'], popularity=self.bot.waifu_im_popularity),
+            order_by=AutocompleteIndex(self.metadata.order_by, display=str.upper,
+                                       popularity=self.bot.waifu_im_popularity),
+        )
+        self.bot.waifu_im_order_by = self.metadata.order_by
+        self.bot.waifu_im_tags = self.metadata.tags
+
+    async def warm_up_metadata(self):
         try:
-            while True:
-                req = await self.bot.session.get('https://api.waifu.im/openapi.json')
-                if req.status != 429:
-                    resp = await req.json()
-                    self.bot.waifu_im_order_by = resp['components']['schemas']['OrderByType']['enum']
-                    break
-                await asyncio.sleep(0.25)
-        except:
-            # If we can't fetch the enum values (wrong status code etc...) we still set up those two
-            self.bot.waifu_im_order_by = ["UPLOADED_AT", "FAVORITES"]
+            await self.metadata.refresh()
+        finally:
+            self.swap_metadata()
+            self.refresh_metadata.start()
 
+    @tasks.loop(minutes=30)
+    async def refresh_metadata(self):
+        # The warm-up already did the first refresh.
+        if self.refresh_metadata.current_loop == 0:
+            return
         try:
-            raws = await self.bot.waifu_client.tags(raw=True)
-            self.bot.waifu_im_tags = dict(sfw=raws['versatile'], nsfw=raws['versatile'] + raws['nsfw'])
-        except:
-            # If some unknown error happen we still set up some tags manually
-            self.bot.waifu_im_tags = dict(sfw=['waifu'], nsfw=['waifu', 'ero'])
+            await self.metadata.refresh()
+        except Exception as e:
+            log.warning(f"Could not refresh the waifu.im metadata, keeping the last copy: {e!r}")
+        finally:
+            self.swap_metadata()
 
     @staticmethod
     async def waifu_launcher(
@@ -130,9 +205,20 @@ class Waifu(commands.Cog):
             return await interaction.followup.send(
                 f"if `order_by` is provided it must be one of the followings : {', '.join(available)}"
             )
+        # Only the tags and orders that exist are counted, anything typed in would otherwise grow the counter.
+        known_tags = interaction.client.waifu_im_tags['sfw' if is_nsfw is False else 'nsfw']
+        interaction.client.waifu_im_popularity.update(t.lower() for t in included_tags or [] if t.lower() in known_tags)
+        if order_by:
+            interaction.client.waifu_im_popularity[order_by] += 1
         start = time.perf_counter()
-        try:
-            r = await interaction.client.waifu_client.search(
+        r = None
+        if (not order_by and not many and not excluded_tags and not full and len(included_tags) == 1
+                and included_tags[0].lower() in known_tags):
+            # A single random image, served from the pre-fetched pool of this tag when possible. Unknown tags are
+            # not pooled, they would only evict the pools of real ones.
+            r = await interaction.client.waifu_pool.get((included_tags[0].lower(), is_nsfw, is_gif))
+        if r is None:
+            params = dict(
                 included_tags=included_tags,
                 excluded_tags=excluded_tags,
                 gif=is_gif,
@@ -141,15 +227,28 @@ class Waifu(commands.Cog):
                 full=full,
                 is_nsfw=is_nsfw,
             )
-        except waifuim.APIException as error:
-            if error.status == 404:
-                return await interaction.followup.send(error.detail)
-            else:
-                raise error
+            try:
+                if order_by:
+                    # Ordered results are the same for everyone, identical concurrent requests share one call.
+                    r = await interaction.client.waifu_gateway.call(
+                        lambda: interaction.client.waifu_client.search(**params),
+                        key=make_key("waifu.im search", **params),
+                        fan_out=copy_results,
+                    )
+                else:
+                    r = await interaction.client.waifu_gateway.call(
+                        lambda: interaction.client.waifu_client.search(**params)
+                    )
+            except waifuim.APIException as error:
+                if error.status == 404:
+                    return await interaction.followup.send(error.detail)
+                else:
+                    raise error
         end = time.perf_counter()
         request_time = round(end - start, 2)
         cleaned_category = included_tags[0].capitalize()
-        await ImageMenu(source=ImageSource(
+        menu_cls = StatelessImageMenu if interaction.client.stateless_menus else ImageMenu
+        await menu_cls(source=ImageSource(
             image_info=r,
             title=cleaned_category,
             per_page=1,
@@ -196,7 +295,10 @@ class Waifu(commands.Cog):
         file = await converter.clean()
         start = time.perf_counter()
         try:
-            image = await self.bot.waifu_client.search(included_files=[file])
+            image = await self.bot.waifu_gateway.call(
+                lambda: self.bot.waifu_client.search(included_files=[file]),
+                key=make_key("waifu.im search", included_files=[file]),
+            )
         except waifuim.APIException as e:
             if e.status == 404:
                 embed = discord.Embed(title="❌ File not found",
@@ -228,23 +330,19 @@ class Waifu(commands.Cog):
         subcommands are the type of picture to return, either sfw or nsfw if nothing is provided no filter will be
         applied. The commands that use the bot [API](https://www.waifu.im) are the nsfw commands and the `waifu`
         command. """
-        try:
-            images = await interaction.client.waifu_client.fav(user_id=interaction.user.id, is_nsfw=is_nsfw)
-        except waifuim.APIException as e:
-            if e.status == 404:
-                return await interaction.response.send_message(
-                    f"You have no favorites. You can add some by using `/waifu sfw` or `/waifu nsfw` and click on ❤️."
-                )
-            else:
-                raise e
+        images = await interaction.client.favorites.images(interaction.user.id, is_nsfw=is_nsfw)
+        if not images:
+            return await interaction.response.send_message(
+                f"You have no favorites. You can add some by using `/waifu sfw` or `/waifu nsfw` and click on ❤️."
+            )
         stop_if_nsfw(not interaction.channel.is_nsfw() and (any(i.is_nsfw for i in images)))
-        title = interaction.user.name + "'s " + (
-            "NSFW " if is_nsfw is True else "SFW " if is_nsfw is False else "") + "favorites"
-        await FavMenu(
-            source=ImageSource(title=title, image_info=images, user=interaction.user, per_page=1),
-            main_interaction=interaction,
-            ephemeral=ephemeral,
-        ).start()
+        source = ImageSource(title=favorites_title(interaction.user, is_nsfw), image_info=images,
+                             user=interaction.user, per_page=1)
+        if interaction.client.stateless_menus:
+            favorites_filter = "a" if is_nsfw is None else "n" if is_nsfw else "s"
+            return await StatelessImageMenu(source=source, main_interaction=interaction, ephemeral=ephemeral,
+                                            favorites_filter=favorites_filter).start()
+        await FavMenu(source=source, main_interaction=interaction, ephemeral=ephemeral).start()
 
     waifu = app_commands.Group(name="waifu", description="Get a random waifu picture from waifu.im API.")
 
@@ -0,0 +1,206 @@
+"""
+Runs Ayane as several clusters, each cluster being a process that runs a range of shards.
+
+    python launcher.py --clusters 4
+    python launcher.py --shards 16 --shards-per-cluster 4 --log-dir logs
+
+The supervisor restarts the clusters that exit, waiting longer each time a cluster crashes shortly after starting.
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import time
+
+import aiohttp
+import discord
+
+from private.config import TOKEN, WEBHOOK_URL
+
+log = logging.getLogger("launcher")
+
+
+def setup_cluster_logging(cluster_id, log_dir=None):
+    handlers = [logging.StreamHandler()]
+    if log_dir:
+        os.makedirs(log_dir, exist_ok=True)
+        handlers.append(logging.FileHandler(os.path.join(log_dir, f"cluster-{cluster_id}.log"), encoding="utf-8"))
+    logging.basicConfig(
+        level=logging.INFO,
+        format=f"[%(asctime)-15s] [Cluster #{cluster_id}] %(message)s",
+        handlers=handlers,
+        force=True,
+    )
+
+
+def run_cluster(cluster_id, shard_ids, shard_count, shutdown, log_dir=None, profile=None):
+    """Entry point of a cluster process, `shutdown` is the event set by the supervisor to close it gracefully."""
+    setup_cluster_logging(cluster_id, log_dir)
+    from main import Ayane
+
+    async def main():
+        bot = Ayane(cluster_id=cluster_id, shard_ids=shard_ids, shard_count=shard_count, profile=profile)
+
+        async def close_on_shutdown():
+            while not shutdown.is_set():
+                await asyncio.sleep(1.0)
+            logging.info("Shutting down.")
+            await bot.close()
+
+        logging.info(f"Starting shards {shard_ids[0]}-{shard_ids[-1]} of {shard_count}.")
+        async with bot:
+            watcher = asyncio.create_task(close_on_shutdown())
+            try:
+                await bot.start(TOKEN)
+            finally:
+                watcher.cancel()
+
+    asyncio.run(main())
+
+
+async def fetch_recommended_shard_count():
+    async with aiohttp.ClientSession() as session:
+        async with session.get(
+                "https://discord.com/api/v10/gateway/bot", headers={"Authorization": f"Bot {TOKEN}"}
+        ) as resp:
+            resp.raise_for_status()
+            data = await resp.json()
+            return data["shards"]
+
+
+class Cluster:
+    def __init__(self, cluster_id, shard_ids):
+        self.cluster_id = cluster_id
+        self.shard_ids = shard_ids
+        self.process = None
+        self.started_at = None
+        self.restarts = 0
+        self.restart_delay = 0.0
+        self.restart_at = None
+
+
+class ClusterSupervisor:
+    # A cluster that ran for longer than this is considered healthy, its restart delay is reset.
+    healthy_after = 600.0
+
+    def __init__(self, shard_count, shards_per_cluster, *, log_dir=None, profile=None, min_restart_delay=5.0,
+                 max_restart_delay=300.0, start_interval=5.0, shutdown_timeout=60.0):
+        self.shard_count = shard_count
+        self.log_dir = log_dir
+        self.profile = profile
+        self.min_restart_delay = min_restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.start_interval = start_interval
+        self.shutdown_timeout = shutdown_timeout
+        self.context = multiprocessing.get_context("spawn")
+        # Set to let every cluster close the bot (and flush what it still has to write) before exiting.
+        self.shutdown = self.context.Event()
+        shard_ids = list(range(shard_count))
+        self.clusters = [
+            Cluster(i, shard_ids[start:start + shards_per_cluster])
+            for i, start in enumerate(range(0, shard_count, shards_per_cluster))
+        ]
+        self.stopping = False
+
+    def spawn(self, cluster):
+        cluster.process = self.context.Process(
+            target=run_cluster,
+            args=(cluster.cluster_id, cluster.shard_ids, self.shard_count, self.shutdown, self.log_dir, self.profile),
+            name=f"ayane-cluster-{cluster.cluster_id}",
+        )
+        cluster.process.start()
+        cluster.started_at = time.monotonic()
+        cluster.restart_at = None
+        log.info(f"Cluster #{cluster.cluster_id} started (pid {cluster.process.pid}, shards {cluster.shard_ids}).")
+
+    def schedule_restart(self, cluster):
+        exitcode = cluster.process.exitcode
+        if time.monotonic() - cluster.started_at > self.healthy_after:
+            cluster.restart_delay = self.min_restart_delay
+        else:
+            cluster.restart_delay = min(max(cluster.restart_delay * 2, self.min_restart_delay),
+                                        self.max_restart_delay)
+        cluster.restarts += 1
+        cluster.restart_at = time.monotonic() + cluster.restart_delay
+        log.warning(f"Cluster #{cluster.cluster_id} exited with code {exitcode}, "
+                    f"restarting in {cluster.restart_delay:.0f}s (restart #{cluster.restarts}).")
+
+    def run(self):
+        # systemd, docker and kill stop the supervisor with SIGTERM, it must stop the clusters as on a Ctrl+C instead of
+        # leaving them running with their gateway sessions.
+        signal.signal(signal.SIGTERM, lambda *_: setattr(self, "stopping", True))
+        try:
+            for cluster in self.clusters:
+                if self.stopping:
+                    break
+                self.spawn(cluster)
+                # Every cluster identifies its shards, spread them so they don't all hit the identify rate limit.
+                start_next_at = time.monotonic() + self.start_interval * len(cluster.shard_ids)
+                while not self.stopping and time.monotonic() < start_next_at:
+                    time.sleep(1.0)
+            while not self.stopping:
+                for cluster in self.clusters:
+                    if cluster.restart_at is not None:
+                        if time.monotonic() >= cluster.restart_at:
+                            self.spawn(cluster)
+                    elif not cluster.process.is_alive():
+                        self.schedule_restart(cluster)
+                time.sleep(1.0)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def stop(self):
+        """Ask every cluster to close gracefully, only the ones still running after `shutdown_timeout` are
+        terminated."""
+        self.stopping = True
+        self.shutdown.set()
+        deadline = time.monotonic() + self.shutdown_timeout
+        for cluster in self.clusters:
+            if cluster.process:
+                cluster.process.join(timeout=max(deadline - time.monotonic(), 0.0))
+        for cluster in self.clusters:
+            if cluster.process and cluster.process.is_alive():
+                log.warning(f"Cluster #{cluster.cluster_id} did not close in time, terminating it.")
+                cluster.process.terminate()
+                cluster.process.join(timeout=10)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run Ayane as multiple clusters of shards.")
+    parser.add_argument("--shards", type=int, default=None,
+                        help="Total number of shards, defaults to the number recommended by Discord.")
+    parser.add_argument("--clusters", type=int, default=None,
+                        help="Number of cluster processes, defaults to the number of CPUs.")
+    parser.add_argument("--shards-per-cluster", type=int, default=None,
+                        help="Number of shards run by each cluster, takes precedence over --clusters.")
+    parser.add_argument("--log-dir", default=None, help="Directory where each cluster writes its own log file.")
+    parser.add_argument("--profile", default=None, choices=["full", "moderation", "lean"],
+                        help="Runtime profile of the clusters, defaults to the AYANE_PROFILE environment variable.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="[%(asctime)-15s] [Launcher] %(message)s")
+    shard_count = args.shards or asyncio.run(fetch_recommended_shard_count())
+    if args.shards_per_cluster:
+        shards_per_cluster = args.shards_per_cluster
+    else:
+        clusters = min(args.clusters or os.cpu_count() or 1, shard_count)
+        shards_per_cluster = -(-shard_count // clusters)
+    log.info(f"Launching {shard_count} shards, {shards_per_cluster} per cluster.")
+
+    try:
+        discord.SyncWebhook.from_url(WEBHOOK_URL).send('👋 Ayane is waking up!')
+    except Exception:
+        pass
+    ClusterSupervisor(shard_count, shards_per_cluster, log_dir=args.log_dir, profile=args.profile).run()
+    try:
+        discord.SyncWebhook.from_url(WEBHOOK_URL).send('🔻 Ayane is going to sleep!')
+    except Exception:
+        pass
+
+
+if __name__ == "__main__":
+    main()
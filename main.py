@@ -1,8 +1,9 @@
 import asyncio
-import io
 import os
 import logging
 import contextlib
+import sys
+import time
 import traceback
 
 import aiohttp
@@ -17,11 +18,24 @@ from discord.ext import commands
 from discord import app_commands
 
 from utils import constants
+from utils.batch import BatchWriter
+from utils.blacklist import BlacklistCache
 from utils.context import AyaneContext
+from utils.errors import ErrorReporter
 from utils.exceptions import UserBlacklisted
 from utils.helpers import PersistentExceptionView
+from utils.paginators import PaginatorDispatcher
 from private.config import (TOKEN, DEFAULT_PREFIXES, OWNER_IDS, DB_CONF, WEBHOOK_URL, WAIFU_API_TOKEN)
-from utils.lock import UserLock
+from utils.lock import UserLock, UserLockRegistry
+from utils.population import GuildPopulation
+from utils.profiles import get_profile, memory_usage
+from utils.settings import GuildSettingsCache, MISSING
+from utils.singleflight import SingleFlight
+from utils.upstream import UpstreamGateway
+from utils.favorites import FavoritesCache
+from utils.stats import BotStatistics
+from utils.timeline import StartupTimeline
+from utils.views import ViewRegistry
 from utils.tree import AyaneCommandTree
 
 log = logging.getLogger(__name__)
@@ -37,30 +51,52 @@ os.environ['JISHAKU_NO_UNDERSCORE'] = 'True'
 os.environ['JISHAKU_HIDE'] = 'True'
 
 
-class Ayane(commands.Bot):
-    def __init__(self):
+class Ayane(commands.AutoShardedBot):
+    def __init__(self, *, cluster_id=0, profile=None, **kwargs):
+        self.started_at = time.perf_counter()
         # These are all attributes that will be set later in the `on_ready_once` method.
         self.pool = None
+        self.blacklist: BlacklistCache = None
+        self.command_writer: BatchWriter = None
+        self.guild_settings: GuildSettingsCache = None
         self.invite: str = None
         self.waifu_client: waifuim.WaifuAioClient = None
         self.session: aiohttp.ClientSession = None
         # All extensions that are not located in the 'cogs' directory.
         self.initial_extensions = ['jishaku']
-        # Disabling the typing intents as we won't be using them.
-        intents = discord.Intents.all()
-        intents.typing = False  # noqa
-        intents.dm_typing = False  # noqa
+        # The cluster this process belongs to when started by the launcher, each cluster runs a range of shards.
+        self.cluster_id = cluster_id
+        # The intents and caches to run with, see `utils.profiles`.
+        self.profile = get_profile(profile or os.environ.get('AYANE_PROFILE', 'full'))
+        self.startup_report = {}
+        self.timeline = StartupTimeline()
+        self.warm_ups = {}
+        self.error_reporter = ErrorReporter(self)
+        self.single_flight = SingleFlight()
+        # Rate limited, retried and circuit broken access to the upstream APIs, see `utils.upstream`.
+        self.waifu_gateway = UpstreamGateway("waifu.im", rate=10, capacity=10, single_flight=self.single_flight)
+        self.anilist_gateway = UpstreamGateway("AniList", rate=1.5, capacity=10, single_flight=self.single_flight)
+        self.favorites = FavoritesCache(self)
+        # Whether the image menus are sent as stateless menus, handled by the dispatcher instead of a live view.
+        self.stateless_menus = os.environ.get('AYANE_STATELESS_MENUS', '').lower() in ('1', 'true', 'yes')
+        self.paginator_dispatcher = PaginatorDispatcher(self)
+        # The live paginator views, the oldest are stopped early past the budget.
+        self.views = ViewRegistry()
         super().__init__(
             tree_cls=AyaneCommandTree,
             command_prefix=commands.when_mentioned_or(*DEFAULT_PREFIXES),
             strip_after_prefix=True,
-            intents=intents
+            **self.profile.client_options(),
+            **kwargs
         )
         self.help_command = None
         self.server_invite = constants.server_invite
         self.owner_ids = OWNER_IDS
         self.colour = self.color = discord.Colour(value=0xA37FFF)
-        self.user_lock = {}
+        self.user_lock = UserLockRegistry()
+        self.population = GuildPopulation()
+        self.statistics = BotStatistics()
+        self.auto_leave_sus_guilds = False
         self.guild_ratio = 0.35
         self.guild_maxbot = 31
         self.minimum_command_interval = 86400
@@ -76,29 +112,42 @@ class Ayane(commands.Bot):
         ]
         self.waifu_im_tags = None
         self.waifu_im_order_by = None
+        self.waifu_im_autocomplete = None
         self.default_checks = {self.check_blacklisted, self.check_user_lock}
 
     async def close(self):
+        if self.command_writer:
+            await self.command_writer.close()
+        if self.blacklist:
+            await self.blacklist.close()
         await self.pool.close()
         await self.waifu_client.close()
         await self.session.close()
         await super().close()
 
+    @property
+    def cluster_label(self):
+        """Describes the shards of this process when it is one cluster of several, None otherwise."""
+        if self.shard_ids is None:
+            return None
+        return f"Cluster #{self.cluster_id}, shards {self.shard_ids[0]}-{self.shard_ids[-1]} of {self.shard_count}"
+
+    def is_sus_guild(self, guild_id, bots, humans):
+        if guild_id in self.guild_whitelist or not bots + humans:
+            return False
+        ratio = bots / (bots + humans)
+        return ratio > self.guild_ratio or bots > self.guild_maxbot
+
     def get_sus_guilds(self):
+        """The suspicious guilds of this cluster, each cluster only judges the guilds of its own shards."""
         sus = []
-        for guild in self.guilds:
-            guild_bots = [m for m in guild.members if m.bots]
-            ratio = len(guild_bots) / len(guild.members)
-            if (
-                    ratio > self.guild_ratio
-                    or len(guild_bots) > self.guild_maxbot
-                    and guild.id not in self.guild_whitelist
-            ):
+        for guild_id, bots, humans in self.population.items():
+            if self.is_sus_guild(guild_id, bots, humans) and (guild := self.get_guild(guild_id)) and guild.chunked:
                 sus.append(guild)
         return sus
 
     def add_user_lock(self, lock: UserLock):
-        self.user_lock.update({lock.user.id: lock})
+        self.user_lock.add(lock)
 
     @staticmethod
     async def check_user_lock(interaction):
@@ -116,27 +165,59 @@ class Ayane(commands.Bot):
 
     @staticmethod
     async def check_blacklisted(interaction):
-        if not hasattr(interaction.client, "pool"):
-            return True
-        result = await interaction.client.is_blacklisted(interaction.user)
+        result = interaction.client.is_blacklisted(interaction.user)
         if result:
             raise UserBlacklisted(interaction.user, reason=result)
         return True
 
-    async def is_blacklisted(self, user):
-        return await self.pool.fetchval("SELECT reason FROM registered_user WHERE id=$1 AND is_blacklisted", user.id)
+    def is_blacklisted(self, user):
+        """Return the blacklist reason of the user if they are blacklisted, this never queries the database."""
+        if self.blacklist is None:
+            return None
+        return self.blacklist.get(user.id)
 
     async def setup_hook(self) -> None:
-        self.pool = await self.establish_database_connection()
+        with self.timeline.measure("database pool"):
+            self.pool = await self.establish_database_connection()
+        self.blacklist = BlacklistCache(self.pool)
+        self.guild_settings = GuildSettingsCache(self.pool)
+        await asyncio.gather(
+            self.timed("blacklist", self.blacklist.start()),
+            self.timed("guild settings", self.guild_settings.load()),
+        )
+        self.command_writer = BatchWriter(self.pool, "commands", ["guild_id", "user_id", "command", "timestamp"])
+        self.command_writer.start()
         ssl_context = ssl.create_default_context(cafile=certifi.where())
         connector = aiohttp.TCPConnector(ssl=ssl_context)
         self.session = aiohttp.ClientSession(connector=connector)
         self.waifu_client = waifuim.WaifuAioClient(app_name="Ayane-Bot", token=WAIFU_API_TOKEN, session=self.session)
-        await self.load_cogs()
+        self.user_lock.sweeper.start()
+        self.add_listener(self.paginator_dispatcher.on_interaction, "on_interaction")
+        with self.timeline.measure("extensions"):
+            await self.load_cogs()
         self.loop.create_task(self.on_ready_once())
 
+    async def timed(self, label, coro):
+        with self.timeline.measure(label):
+            return await coro
+
+    def warm_up(self, name, coro):
+        """Run a cog network or cache warm-up in the background instead of blocking the startup.
+
+        The cog is expected to serve a fallback until the warm-up is done."""
+        async def runner():
+            try:
+                await self.timed(f"warm-up {name}", coro)
+            except Exception as e:
+                logging.error(f"{err} Warm-up {name} failed {err}", exc_info=e)
+
+        task = self.loop.create_task(runner())
+        self.warm_ups[name] = task
+        return task
+
     async def on_ready_once(self):
         await self.wait_until_ready()
+        self.timeline.mark("ready")
         self.invite = discord.utils.oauth_url(self.user.id,
                                               permissions=discord.Permissions(173211516614),
                                               redirect_uri=self.server_invite,
@@ -147,6 +228,34 @@ class Ayane(commands.Bot):
                 type=discord.ActivityType.watching, name="Hentai! 🍑"
             )
         )
+        self.startup_report.update(
+            profile=self.profile.name,
+            ready_after=round(time.perf_counter() - self.started_at, 2),
+        )
+        if self.profile.lazy_chunking:
+            start = time.perf_counter()
+            chunked = await self.timed("member chunking", self.chunk_moderated_guilds())
+            self.startup_report.update(chunked_guilds=chunked, chunked_in=round(time.perf_counter() - start, 2))
+        self.startup_report.update(memory=memory_usage())
+        logging.info(f"{ok} Startup report: " + ", ".join(f"{k}={v}" for k, v in self.startup_report.items()))
+        # The warm-ups keep going after the ready event, the timeline is logged once all of them are done.
+        await asyncio.gather(*self.warm_ups.values(), return_exceptions=True)
+        self.timeline.log()
+
+    def needs_member_cache(self, guild):
+        """Whether a guild has moderation features turned on, and therefore needs its members cached."""
+        return self.guild_settings.get_anti_spam_mode(guild.id) not in (None, MISSING)
+
+    async def chunk_moderated_guilds(self):
+        """Chunk the guilds that need their member cache, the others are never chunked with lazy chunking."""
+        chunked = 0
+        for guild in self.guilds:
+            if not guild.chunked and self.needs_member_cache(guild):
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await guild.chunk()
+                    self.population.add_guild(guild)
+                    chunked += 1
+        return chunked
 
     @staticmethod
     async def establish_database_connection() -> asyncpg.Pool:
@@ -175,25 +284,20 @@ class Ayane(commands.Bot):
 
     async def on_error(self, event_method: str, *args, **kwargs) -> None:
         """ Logs uncaught exceptions and sends them to the error log channel in the support guild. """
+        error = sys.exc_info()[1]
         traceback_string = traceback.format_exc()
-        for line in traceback_string.split('\n'):
-            logging.info(line)
 
         await self.wait_until_ready()
-        error_channel = self.get_channel(1024838787622244452)
+        error_channel = self.get_partial_messageable(1024838787622244452)
         to_send = f"```yaml\nAn error occurred in an {event_method} event``````py" \
                   f"\n{traceback_string}\n```"
-
-        if len(to_send) < 2000:
-            try:
-                await error_channel.send(to_send)
-
-            except (discord.Forbidden, discord.HTTPException):
-                await error_channel.send(f"```yaml\nAn error occurred in an {event_method} event``````py",
-                                         file=discord.File(io.StringIO(traceback_string), filename='traceback.py'))
-        else:
-            await error_channel.send(f"```yaml\nAn error occurred in an {event_method} event``````py",
-                                     file=discord.File(io.StringIO(traceback_string), filename='traceback.py'))
+        await self.error_reporter.report(
+            error_channel,
+            error,
+            to_send,
+            traceback_string,
+            file_content=f"```yaml\nAn error occurred in an {event_method} event``````py",
+        )
 
     @staticmethod
     async def send_interaction_error_message(interaction, *args, **kwargs):
@@ -213,7 +317,7 @@ class Ayane(commands.Bot):
             embed.add_field(name="Traceback :", value=f"```py\n{type(error).__name__} : {error}```")
             await interaction.client.send_interaction_error_message(interaction, embed=embed, **kwargs)
 
-        error_channel = interaction.client.get_channel(920086735755575327)
+        error_channel = interaction.client.get_partial_messageable(920086735755575327)
         traceback_string = "".join(traceback.format_exception(error, value=error, tb=error.__traceback__))
         if interaction.guild:
             command_data = (
@@ -236,42 +340,37 @@ class Ayane(commands.Bot):
             f"\n{traceback_string}\n```"
         )
 
-        try:
-            if len(to_send) < 2000:
-                await error_channel.send(to_send, view=PersistentExceptionView(interaction.client))
-            else:
-                file = discord.File(
-                    io.StringIO(traceback_string), filename="traceback.py"
-                )
-                await error_channel.send(
-                    f"```yaml\n{command_data}``````py Command {command_name} raised the following error:\n```",
-                    file=file,
-                    view=PersistentExceptionView(interaction.client),
-                )
-        finally:
-            for line in traceback_string.split("\n"):
-                logging.info(line)
+        await interaction.client.error_reporter.report(
+            error_channel,
+            error,
+            to_send,
+            traceback_string,
+            file_content=f"```yaml\n{command_data}``````py Command {command_name} raised the following error:\n```",
+            view=PersistentExceptionView(interaction.client),
+        )
 
     async def load_cogs(self):
         """
-        Loads all the extensions in the ./cogs directory.
+        Loads all the extensions in the ./cogs directory, concurrently as they don't depend on each other.
         """
         extensions = [f"cogs.{f[:-3]}" for f in os.listdir("./cogs") if f.endswith(".py")  # 'Cogs' folder
                       ] + self.initial_extensions  # Initial extensions like jishaku or others that may be elsewhere
-        for ext in extensions:
-            try:
-                await self.load_extension(ext)
-                logging.info(f"{ok} Loaded extension {ext}")
+        await asyncio.gather(*(self.load_cog(ext) for ext in extensions))
 
-            except Exception as e:
-                if isinstance(e, commands.ExtensionNotFound):
-                    logging.error(f"{oop} Extension {ext} was not found {oop}", exc_info=False)
+    async def load_cog(self, ext):
+        try:
+            await self.timed(f"extension {ext}", self.load_extension(ext))
+            logging.info(f"{ok} Loaded extension {ext}")
 
-                elif isinstance(e, commands.NoEntryPointError):
-                    logging.error(f"{err} Extension {ext} has no setup function {err}", exc_info=False)
+        except Exception as e:
+            if isinstance(e, commands.ExtensionNotFound):
+                logging.error(f"{oop} Extension {ext} was not found {oop}", exc_info=False)
+
+            elif isinstance(e, commands.NoEntryPointError):
+                logging.error(f"{err} Extension {ext} has no setup function {err}", exc_info=False)
 
-                else:
-                    logging.error(f"{err}{err} Failed to load extension {ext} {err}{err}", exc_info=e)
+            else:
+                logging.error(f"{err}{err} Failed to load extension {ext} {err}{err}", exc_info=e)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,45 @@
+import bisect
+from collections import Counter
+
+from discord import app_commands
+
+from utils.cache import ExpiringCache
+
+
+class AutocompleteIndex:
+    """Precomputed autocomplete choices for a fixed list of values.
+
+    The values are lowered and sorted once so the prefix matches are found with a binary search. Prefix matches
+    rank above substring matches, then the most popular values come first. The results are memoised per query for
+    `memo_ttl` seconds, which is also how long a change of popularity takes to show up."""
+
+    def __init__(self, values, *, display=str.capitalize, popularity=None, limit=25, memo_ttl=60.0, memo_size=512):
+        self.display = display
+        self.popularity = popularity if popularity is not None else Counter()
+        self.limit = limit
+        self._entries = sorted((value.lower(), value) for value in values)
+        self._keys = [lowered for lowered, _ in self._entries]
+        self._memo = ExpiringCache(seconds=memo_ttl, max_size=memo_size)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _rank(self, values):
+        return sorted(values, key=lambda value: -self.popularity[value])
+
+    def search(self, current):
+        query = current.lower().strip()
+        try:
+            return self._memo[query]
+        except KeyError:
+            pass
+        start = bisect.bisect_left(self._keys, query)
+        end = bisect.bisect_right(self._keys, query + "\uffff")
+        prefix = [value for _, value in self._entries[start:end]]
+        ranked = self._rank(prefix)
+        if len(ranked) < self.limit and query:
+            substring = [value for lowered, value in self._entries if query in lowered and not lowered.startswith(query)]
+            ranked += self._rank(substring)
+        choices = [app_commands.Choice(name=self.display(value), value=value) for value in ranked[:self.limit]]
+        self._memo[query] = choices
+        return choices
@@ -0,0 +1,135 @@
+import asyncio
+import contextlib
+import logging
+
+import asyncpg
+
+log = logging.getLogger(__name__)
+
+
+class BatchWriter:
+    """Write-behind buffer that inserts rows in batches with `copy_records_to_table`.
+
+    Rows are flushed when `max_batch` rows are waiting or every `interval` seconds. When more than `max_pending`
+    rows are waiting, `add` waits up to `put_timeout` seconds for a flush to make room then drops the row.
+
+    A batch that failed because the database could not be reached is retried by the next `max_retries` flushes then
+    dropped. A batch the database rejected is split until the rejected rows are found, only those are dropped."""
+
+    # The errors after which the same rows may succeed later.
+    transient_errors = (asyncpg.PostgresConnectionError, asyncpg.InterfaceError, OSError, asyncio.TimeoutError)
+
+    def __init__(self, pool, table, columns, *, max_batch=500, interval=5.0, max_pending=10000, put_timeout=1.0,
+                 max_retries=3):
+        self.pool = pool
+        self.table = table
+        self.columns = columns
+        self.max_batch = max_batch
+        self.interval = interval
+        self.put_timeout = put_timeout
+        self.max_retries = max_retries
+        self.queued = 0
+        self.flushed = 0
+        self.dropped = 0
+        self._queue = asyncio.Queue(maxsize=max_pending)
+        # The rows of the last batch that could not reach the database, and how many times they were tried.
+        self._retry = []
+        self._retry_attempts = 0
+        self._batch_ready = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task = None
+        self._closing = False
+
+    @property
+    def pending(self):
+        return self._queue.qsize() + len(self._retry)
+
+    def stats(self):
+        return dict(queued=self.queued, flushed=self.flushed, dropped=self.dropped, pending=self.pending)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def add(self, *record):
+        """Queue a row, returns False if the row had to be dropped."""
+        try:
+            self._queue.put_nowait(record)
+        except asyncio.QueueFull:
+            self._batch_ready.set()
+            try:
+                await asyncio.wait_for(self._queue.put(record), self.put_timeout)
+            except asyncio.TimeoutError:
+                self.dropped += 1
+                return False
+        self.queued += 1
+        if self._queue.qsize() >= self.max_batch:
+            self._batch_ready.set()
+        return True
+
+    async def flush(self):
+        """Write every pending row to the database, returns the number of rows written."""
+        async with self._flush_lock:
+            written = 0
+            if self._retry:
+                records, self._retry = self._retry, []
+                written += await self._write(records, self._retry_attempts + 1)
+                if self._retry:
+                    # Still unreachable, the queued rows would fail the same way.
+                    return written
+            records = []
+            while not self._queue.empty():
+                records.append(self._queue.get_nowait())
+            if records:
+                written += await self._write(records, 1)
+            return written
+
+    async def _write(self, records, attempt):
+        """Copy the rows, splitting the batch around the rows the database rejects. Returns the number written."""
+        written = 0
+        chunks = [records]
+        while chunks:
+            chunk = chunks.pop()
+            try:
+                await self.pool.copy_records_to_table(self.table, records=chunk, columns=self.columns)
+            except self.transient_errors as e:
+                remaining = [record for c in [chunk, *reversed(chunks)] for record in c]
+                if attempt < self.max_retries:
+                    self._retry, self._retry_attempts = remaining, attempt
+                    log.warning(f"Could not flush {len(remaining)} rows to '{self.table}' "
+                                f"(attempt {attempt}/{self.max_retries}), retrying with the next flush: {e!r}")
+                else:
+                    self.dropped += len(remaining)
+                    log.error(f"Dropped {len(remaining)} rows that could not be flushed to '{self.table}' "
+                              f"after {attempt} attempts", exc_info=e)
+                break
+            except Exception as e:
+                if len(chunk) == 1:
+                    self.dropped += 1
+                    log.warning(f"Dropped a row rejected by '{self.table}': {chunk[0]!r} ({e!r})")
+                    continue
+                middle = len(chunk) // 2
+                chunks += [chunk[middle:], chunk[:middle]]
+                continue
+            written += len(chunk)
+        self.flushed += written
+        return written
+
+    async def close(self):
+        """Stop the background flusher and write what is left in the buffer."""
+        self._closing = True
+        self._batch_ready.set()
+        if self._task is not None:
+            # Let an in-flight flush finish instead of cancelling it halfway through the copy.
+            await self._task
+            self._task = None
+        await self.flush()
+        if self.pending:
+            log.error(f"Closing with {self.pending} rows that could not be written to '{self.table}'")
+
+    async def _run(self):
+        while not self._closing:
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._batch_ready.wait(), self.interval)
+            self._batch_ready.clear()
+            await self.flush()
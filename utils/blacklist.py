@@ -0,0 +1,143 @@
+import asyncio
+import logging
+
+log = logging.getLogger(__name__)
+
+# Notifies the id of every user whose row changed, installed by `BlacklistCache.start` if it does not exist yet.
+NOTIFY_TRIGGER_SQL = """
+CREATE OR REPLACE FUNCTION notify_blacklist_update() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('blacklist_update', OLD.id::text);
+        RETURN OLD;
+    END IF;
+    PERFORM pg_notify('blacklist_update', NEW.id::text);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'registered_user_blacklist_update') THEN
+        CREATE TRIGGER registered_user_blacklist_update
+            AFTER INSERT OR UPDATE OF is_blacklisted, reason OR DELETE ON registered_user
+            FOR EACH ROW EXECUTE FUNCTION notify_blacklist_update();
+    END IF;
+END;
+$$;
+"""
+
+
+class BlacklistCache:
+    """In-memory copy of the blacklisted users so the blacklist checks never hit the database.
+
+    The whole blacklist is loaded once with `sync` then kept up to date through a Postgres LISTEN/NOTIFY channel.
+    The `registered_user` table notifies the changed user id on `channel` with the trigger of `NOTIFY_TRIGGER_SQL`.
+    If the listening connection drops, a new one is acquired and the whole blacklist is synced again since the
+    notifications sent in between are lost."""
+
+    def __init__(self, pool, channel="blacklist_update"):
+        self.pool = pool
+        self.channel = channel
+        self._reasons = {}
+        self._connection = None
+        self._closing = False
+        self._tasks = set()
+
+    def __contains__(self, user_id):
+        return user_id in self._reasons
+
+    def __len__(self):
+        return len(self._reasons)
+
+    def get(self, user_id):
+        """Return the blacklist reason of a user or None if the user is not blacklisted."""
+        return self._reasons.get(user_id)
+
+    async def sync(self):
+        """Reload the whole blacklist from the database, returns the number of blacklisted users."""
+        records = await self.pool.fetch("SELECT id, reason FROM registered_user WHERE is_blacklisted")
+        self._reasons = {r["id"]: r["reason"] or "No reason provided" for r in records}
+        return len(self._reasons)
+
+    async def refresh(self, user_id):
+        """Reload the blacklist state of a single user."""
+        record = await self.pool.fetchrow("SELECT reason, is_blacklisted FROM registered_user WHERE id=$1", user_id)
+        if record and record["is_blacklisted"]:
+            self._reasons[user_id] = record["reason"] or "No reason provided"
+        else:
+            self._reasons.pop(user_id, None)
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def install_trigger(self):
+        try:
+            await self.pool.execute(NOTIFY_TRIGGER_SQL)
+        except Exception as e:
+            log.warning(f"Could not install the blacklist notification trigger: {e!r}")
+
+    async def listen(self):
+        # The listener needs a connection of its own for as long as the bot runs.
+        self._connection = await self.pool.acquire()
+        self._connection.add_termination_listener(self._on_termination)
+        await self._connection.add_listener(self.channel, self._on_notification)
+
+    async def start(self):
+        await self.install_trigger()
+        await self.sync()
+        await self.listen()
+        log.info(f"Blacklist loaded with {len(self)} users, listening on '{self.channel}'.")
+
+    async def _release(self):
+        connection, self._connection = self._connection, None
+        if connection is not None:
+            try:
+                await self.pool.release(connection)
+            except Exception:
+                pass
+
+    async def reconnect(self, max_delay=60.0):
+        delay = 1.0
+        while not self._closing:
+            await self._release()
+            try:
+                await self.listen()
+                count = await self.sync()
+            except Exception as e:
+                log.warning(f"Could not listen to '{self.channel}' again, retrying in {delay:.0f}s: {e!r}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, max_delay)
+                continue
+            log.info(f"Listening on '{self.channel}' again, blacklist resynced with {count} users.")
+            return
+
+    async def close(self):
+        self._closing = True
+        for task in list(self._tasks):
+            task.cancel()
+        if self._connection is None:
+            return
+        try:
+            self._connection.remove_termination_listener(self._on_termination)
+            await self._connection.remove_listener(self.channel, self._on_notification)
+        finally:
+            await self.pool.release(self._connection)
+            self._connection = None
+
+    def _on_termination(self, connection):
+        if self._closing or connection is not self._connection:
+            return
+        log.warning(f"The connection listening on '{self.channel}' was closed, reconnecting.")
+        self._spawn(self.reconnect())
+
+    def _on_notification(self, connection, pid, channel, payload):
+        try:
+            user_id = int(payload)
+        except (TypeError, ValueError):
+            log.warning(f"Ignoring malformed blacklist notification payload: {payload!r}")
+            return
+        self._spawn(self.refresh(user_id))
@@ -1,28 +1,137 @@
+import asyncio
 import time
+from collections import OrderedDict, deque
+from collections.abc import MutableMapping
 
 
-class ExpiringCache(dict):
-    """https://github.com/Rapptz/RoboDanny/blob/1fb95d76d1b7685e2e2ff950e11cddfc96efbfec/cogs/utils/cache.py
-    really useful cache that keeps key/values for a certain given time"""
+class ExpiringCache(MutableMapping):
+    """Dict-like cache that keeps key/values for a certain given time, inspired by
+    https://github.com/Rapptz/RoboDanny/blob/1fb95d76d1b7685e2e2ff950e11cddfc96efbfec/cogs/utils/cache.py
 
-    def __init__(self, seconds):
+    Expired keys are dropped from a queue ordered by expiry time, so each operation only looks at the keys that
+    actually expired instead of scanning the whole cache. If `max_size` is set, the least recently used keys are
+    evicted once the cache is full."""
+
+    def __init__(self, seconds, max_size=None):
         self.__ttl = seconds
-        super().__init__()
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        # key -> (value, expiry time), ordered from the least to the most recently used key.
+        self.__entries = OrderedDict()
+        # (expiry time, key) pairs, ordered by expiry time since the ttl is the same for every key.
+        self.__expiries = deque()
 
-    def __verify_cache_integrity(self):
-        # Have to do this in two steps...
+    def __expire(self):
         current_time = time.monotonic()
-        to_remove = [k for (k, (v, t)) in self.items() if current_time > (t + self.__ttl)]
-        for k in to_remove:
-            del self[k]
+        while self.__expiries and self.__expiries[0][0] <= current_time:
+            expires_at, key = self.__expiries.popleft()
+            entry = self.__entries.get(key)
+            # The key may have been set again or deleted since this expiry was queued.
+            if entry is not None and entry[1] == expires_at:
+                del self.__entries[key]
+                self.expirations += 1
 
     def __contains__(self, key):
-        self.__verify_cache_integrity()
-        return super().__contains__(key)
+        self.__expire()
+        if key in self.__entries:
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
 
     def __getitem__(self, key):
-        self.__verify_cache_integrity()
-        return super().__getitem__(key)
+        self.__expire()
+        try:
+            value, _ = self.__entries[key]
+        except KeyError:
+            self.misses += 1
+            raise
+        self.hits += 1
+        self.__entries.move_to_end(key)
+        return value
 
     def __setitem__(self, key, value):
-        super().__setitem__(key, (value, time.monotonic()))
+        self.__expire()
+        expires_at = time.monotonic() + self.__ttl
+        self.__entries[key] = (value, expires_at)
+        self.__entries.move_to_end(key)
+        self.__expiries.append((expires_at, key))
+        if len(self.__expiries) > 2 * len(self.__entries) + 64:
+            # Too many stale expiries from overwritten, deleted or evicted keys, rebuild the queue.
+            self.__expiries = deque(sorted(((t, k) for k, (_, t) in self.__entries.items()), key=lambda e: e[0]))
+        if self.max_size is not None:
+            while len(self.__entries) > self.max_size:
+                self.__entries.popitem(last=False)
+                self.evictions += 1
+
+    def __delitem__(self, key):
+        del self.__entries[key]
+
+    def __iter__(self):
+        self.__expire()
+        return iter(list(self.__entries))
+
+    def __len__(self):
+        self.__expire()
+        return len(self.__entries)
+
+    def __repr__(self):
+        return f"<{type(self).__name__} ttl={self.__ttl} max_size={self.max_size} size={len(self)}>"
+
+    def clear(self):
+        self.__entries.clear()
+        self.__expiries.clear()
+
+    def stats(self):
+        return dict(
+            size=len(self),
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+            expirations=self.expirations,
+        )
+
+
+class RevalidatingCache:
+    """Async cache serving stale values while they are refreshed in the background.
+
+    A value is fresh for `max_age` seconds, after which it is still served for up to `max_stale` seconds while a
+    single background refresh replaces it. Only a miss, or a value older than both, waits for the upstream."""
+
+    def __init__(self, max_age, max_stale, max_size=None):
+        self.max_age = max_age
+        # key -> (value, fetched at)
+        self._entries = ExpiringCache(seconds=max_age + max_stale, max_size=max_size)
+        self._refreshes = {}
+        self.stale = 0
+        self.refresh_errors = 0
+
+    async def _fetch(self, key, fetch):
+        value = await fetch()
+        self._entries[key] = (value, time.monotonic())
+        return value
+
+    def _refresh_done(self, key, task):
+        self._refreshes.pop(key, None)
+        if not task.cancelled() and task.exception() is not None:
+            self.refresh_errors += 1
+
+    async def get(self, key, fetch):
+        """Return the value of `key`, `fetch` being the coroutine function returning a new one."""
+        try:
+            value, fetched_at = self._entries[key]
+        except KeyError:
+            return await self._fetch(key, fetch)
+        if time.monotonic() - fetched_at > self.max_age:
+            self.stale += 1
+            if key not in self._refreshes:
+                task = self._refreshes[key] = asyncio.create_task(self._fetch(key, fetch))
+                task.add_done_callback(lambda t: self._refresh_done(key, t))
+        return value
+
+    def stats(self):
+        return dict(stale=self.stale, refreshing=len(self._refreshes), refresh_errors=self.refresh_errors,
+                    **self._entries.stats())
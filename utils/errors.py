@@ -0,0 +1,138 @@
+import asyncio
+import hashlib
+import io
+import logging
+import time
+import traceback
+
+import discord
+
+from utils.cache import ExpiringCache
+
+log = logging.getLogger(__name__)
+
+# Separates the error report from the occurrence counter appended to it.
+OCCURRENCES_MARKER = "\n🔁 "
+
+
+def fingerprint(error):
+    """A short hash identifying an error by its type and the frames it went through, line numbers included."""
+    parts = [type(error).__module__, type(error).__qualname__]
+    parts += [f"{frame.filename}:{frame.name}:{frame.lineno}" for frame in traceback.extract_tb(error.__traceback__)]
+    return hashlib.sha1("|".join(parts).encode()).hexdigest()[:16]
+
+
+class ErrorGroup:
+    def __init__(self, key, content):
+        self.key = key
+        self.content = content
+        self.count = 1
+        self.edited_count = 1
+        self.first_seen = self.last_seen = discord.utils.utcnow()
+        self.message = None
+        self.sent = asyncio.Event()
+        self.edit_task = None
+        self.last_edit = 0.0
+        self.resolved = False
+
+    def format(self):
+        if self.count <= 1:
+            return self.content
+        return (
+            f"{self.content}{OCCURRENCES_MARKER}Occurred **{self.count}** times, "
+            f"last {discord.utils.format_dt(self.last_seen, style='R')}"
+        )
+
+
+class ErrorReporter:
+    """Sends the unexpected errors to the error channels, once per error.
+
+    The same error raised again within `window` seconds is not sent again, the occurrence counter of the first
+    report is edited instead, at most once every `edit_interval` seconds."""
+
+    def __init__(self, bot, window=3600.0, edit_interval=30.0, max_groups=500):
+        self.bot = bot
+        self.edit_interval = edit_interval
+        self.groups = ExpiringCache(seconds=window, max_size=max_groups)
+        self.message_groups = ExpiringCache(seconds=window, max_size=max_groups)
+        self.sent = 0
+        self.aggregated = 0
+
+    def stats(self):
+        return dict(groups=len(self.groups), sent=self.sent, aggregated=self.aggregated)
+
+    async def report(self, channel, error, content, traceback_string, *, file_content=None, view=None):
+        """Report an error in `channel`, returns whether a new message was sent.
+
+        `content` is sent if it fits in a message, otherwise `file_content` is sent with the traceback as a file."""
+        key = (channel.id, fingerprint(error))
+        group = self.groups.get(key)
+        if group is not None and not group.resolved:
+            group.count += 1
+            group.last_seen = discord.utils.utcnow()
+            # Setting it again keeps the group in the cache as long as the error keeps happening, and its message so
+            # it can still be resolved.
+            self.groups[key] = group
+            if group.message is not None:
+                self.message_groups[group.message.id] = group
+            self.aggregated += 1
+            log.info(f"{type(error).__name__} occurred again ({group.count} times): {error}")
+            self.schedule_edit(group)
+            return False
+
+        group = self.groups[key] = ErrorGroup(key, content)
+        for line in traceback_string.split("\n"):
+            log.info(line)
+        extras = dict(view=view) if view is not None else {}
+        try:
+            # Leave some room for the occurrence counter.
+            if len(content) < 1900:
+                try:
+                    group.message = await channel.send(content, **extras)
+                except discord.HTTPException:
+                    pass
+            if group.message is None:
+                group.content = file_content
+                file = discord.File(io.StringIO(traceback_string), filename="traceback.py")
+                group.message = await channel.send(file_content, file=file, **extras)
+        except Exception:
+            self.groups.pop(key, None)
+            raise
+        finally:
+            group.sent.set()
+        self.message_groups[group.message.id] = group
+        self.sent += 1
+        if group.count > 1:
+            self.schedule_edit(group)
+        return True
+
+    def schedule_edit(self, group):
+        if group.edit_task is None or group.edit_task.done():
+            group.edit_task = asyncio.create_task(self._edit(group))
+
+    async def _edit(self, group):
+        await group.sent.wait()
+        # Occurrences may keep coming while editing, loop until the message shows the latest count.
+        while group.message is not None and not group.resolved and group.edited_count != group.count:
+            delay = group.last_edit + self.edit_interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            count = group.count
+            group.last_edit = time.monotonic()
+            try:
+                await group.message.edit(content=group.format())
+            except discord.HTTPException:
+                pass
+            group.edited_count = count
+
+    def resolve(self, message_id):
+        """Mark the group of a reported message as resolved, the next occurrence is reported as a new error."""
+        group = self.message_groups.get(message_id)
+        if group is None:
+            return None
+        group.resolved = True
+        if group.edit_task is not None:
+            group.edit_task.cancel()
+        self.groups.pop(group.key, None)
+        self.message_groups.pop(message_id, None)
+        return group
@@ -76,6 +76,15 @@ class APIServerError(app_commands.AppCommandError):
     pass
 
 
+class UpstreamUnavailable(APIServerError):
+    """Exception raised when an upstream API is failing and its circuit breaker is open"""
+
+    def __init__(self, name, retry_after=0.0):
+        self.name = name
+        self.retry_after = retry_after
+        super().__init__(f"{name} is currently unavailable, please retry in a few seconds.")
+
+
 class AlreadyMuted(Exception):
     pass
 
@@ -0,0 +1,99 @@
+import waifuim
+
+from utils.cache import ExpiringCache
+from utils.singleflight import make_key
+
+
+class UserFavorites:
+    """The favorites of a user: the images in the order waifu.im returned them and the set of their ids."""
+
+    def __init__(self, images):
+        self.images = list(images)
+        self.ids = {image.image_id for image in self.images}
+
+    def __contains__(self, image_id):
+        return image_id in self.ids
+
+    def __len__(self):
+        return len(self.images)
+
+    def add(self, image):
+        if image.image_id not in self.ids:
+            self.ids.add(image.image_id)
+            self.images.append(image)
+
+    def remove(self, image_id):
+        if image_id in self.ids:
+            self.ids.discard(image_id)
+            self.images = [image for image in self.images if image.image_id != image_id]
+
+    def filter(self, is_nsfw=None):
+        """A copy of the images, only the nsfw or sfw ones if `is_nsfw` is set."""
+        return [image for image in self.images if is_nsfw is None or image.is_nsfw == is_nsfw]
+
+
+class FavoritesCache:
+    """Per-user waifu.im favorites, fetched once and kept for `ttl` seconds.
+
+    The favorite toggles made through the bot update the cached favorites in place instead of dropping them, so
+    checking whether an image is in the favorites of a user makes no request most of the time. At most `max_size`
+    users are kept, the least recently used are evicted first."""
+
+    def __init__(self, bot, *, ttl=300.0, max_size=2000):
+        self.bot = bot
+        self._entries = ExpiringCache(seconds=ttl, max_size=max_size)
+        # Users whose favorites are being fetched and users toggled while they were, whose result is then outdated.
+        self._fetching = {}
+        self._outdated = set()
+
+    def stats(self):
+        return self._entries.stats()
+
+    async def get(self, user_id):
+        try:
+            return self._entries[user_id]
+        except KeyError:
+            pass
+        self._fetching[user_id] = self._fetching.get(user_id, 0) + 1
+        try:
+            images = await self.bot.waifu_gateway.call(
+                lambda: self.bot.waifu_client.fav(user_id=user_id),
+                key=make_key("waifu.im fav", user_id=user_id, is_nsfw=None),
+            )
+        except waifuim.APIException as e:
+            if e.status != 404:
+                raise
+            images = []
+        finally:
+            self._fetching[user_id] -= 1
+            if not self._fetching[user_id]:
+                del self._fetching[user_id]
+        favorites = UserFavorites(images if isinstance(images, list) else [images])
+        if user_id in self._outdated:
+            if user_id not in self._fetching:
+                self._outdated.discard(user_id)
+        else:
+            self._entries[user_id] = favorites
+        return favorites
+
+    async def contains(self, user_id, image_id):
+        return image_id in await self.get(user_id)
+
+    async def images(self, user_id, is_nsfw=None):
+        return (await self.get(user_id)).filter(is_nsfw)
+
+    def toggled(self, user_id, image, state):
+        """Apply the result of a `fav_toggle` call to the cached favorites of the user."""
+        if user_id in self._fetching:
+            self._outdated.add(user_id)
+        try:
+            favorites = self._entries[user_id]
+        except KeyError:
+            return
+        if state == "INSERTED":
+            favorites.add(image)
+        else:
+            favorites.remove(image.image_id)
+
+    def discard(self, user_id):
+        self._entries.pop(user_id, None)
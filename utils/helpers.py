@@ -3,6 +3,7 @@ from collections import Counter
 import discord
 
 from utils.context import AyaneContext
+from utils.errors import OCCURRENCES_MARKER
 from utils.exceptions import NSFWChannelRequired
 from private.config import LOCAL
 
@@ -75,5 +76,10 @@ class PersistentExceptionView(discord.ui.View):
     @discord.ui.button(emoji='🗑', label='Mark as resolved', custom_id='persistant_exception_view_mark_as_resolved')
     async def resolve(self, interaction: discord.Interaction, _):
         message = interaction.message
-        error = '```py\n' + '\n'.join(message.content.split('\n')[7:])
-        await message.edit(content=f"{error}```fix\n✅ Marked as fixed by {interaction.user}.```", view=None)
+        group = self.bot.error_reporter.resolve(message.id)
+        occurrences = f" after {group.count} occurrences" if group and group.count > 1 else ""
+        content = message.content.split(OCCURRENCES_MARKER)[0]
+        error = '```py\n' + '\n'.join(content.split('\n')[7:])
+        await message.edit(
+            content=f"{error}```fix\n✅ Marked as fixed by {interaction.user}{occurrences}.```", view=None
+        )
@@ -1,4 +1,9 @@
 import asyncio
+import time
+import weakref
+
+from discord.ext import tasks
+
 from utils.exceptions import UserLocked
 
 
@@ -13,17 +18,89 @@ class UserLock:
         self.user = user
         self.error_message = error_message
         self.lock = asyncio.Lock()
+        self.acquired_at = None
 
     def __call__(self, bot):
         bot.add_user_lock(self)
-        return self.lock
+        return self
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *args):
+        self.release()
+
+    async def acquire(self):
+        await self.lock.acquire()
+        self.acquired_at = time.monotonic()
+        return True
 
     def locked(self):
         return self.lock.locked()
 
     def release(self):
+        self.acquired_at = None
         self.lock.release()
 
+    @property
+    def held_for(self):
+        """For how many seconds the lock has been held, None if it is not held."""
+        if self.acquired_at is None:
+            return None
+        return time.monotonic() - self.acquired_at
+
     @property
     def error(self):
         return UserLocked(message=self.error_message)
+
+
+class UserLockRegistry:
+    """The user locks of the bot indexed by user id.
+
+    Locks are referenced weakly so they go away with whatever was holding them, and the released locks that are
+    still referenced somewhere are swept every `sweep_interval` seconds."""
+
+    def __init__(self, sweep_interval=300.0):
+        self._locks = weakref.WeakValueDictionary()
+        self.swept = 0
+        self.sweeper = tasks.loop(seconds=sweep_interval)(self.sweep)
+
+    def __len__(self):
+        return len(self._locks)
+
+    def __contains__(self, user_id):
+        return user_id in self._locks
+
+    def add(self, lock):
+        self._locks[lock.user.id] = lock
+
+    def get(self, user_id, default=None):
+        return self._locks.get(user_id, default)
+
+    def pop(self, user_id, default=None):
+        return self._locks.pop(user_id, default)
+
+    async def sweep(self):
+        released = [user_id for user_id, lock in self._locks.items() if not lock.locked()]
+        for user_id in released:
+            self._locks.pop(user_id, None)
+        self.swept += len(released)
+        return len(released)
+
+    def held(self, min_seconds=0.0):
+        """The held locks that have been held for at least `min_seconds`, longest held first."""
+        locks = [
+            lock for lock in self._locks.values()
+            if lock.locked() and (lock.held_for is None or lock.held_for >= min_seconds)
+        ]
+        return sorted(locks, key=lambda lock: lock.held_for or 0.0, reverse=True)
+
+    def stats(self):
+        held = self.held()
+        return dict(
+            registered=len(self),
+            held=len(held),
+            longest_held=f"{held[0].held_for or 0.0:.1f}s" if held else None,
+            swept=self.swept,
+        )
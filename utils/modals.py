@@ -43,10 +43,13 @@ class ReportModal(BaseModal):
         super().__init__(title="Report", **kwargs)
 
     async def on_submit(self, interaction) -> None:
-        await self.view.bot.waifu_client.report(
-            self.view.image_info.image_id,
-            user_id=interaction.user.id,
-            description=self.reason.value.strip(" "),
+        await self.view.bot.waifu_gateway.call(
+            lambda: self.view.bot.waifu_client.report(
+                self.view.image_info.image_id,
+                user_id=interaction.user.id,
+                description=self.reason.value.strip(" "),
+            ),
+            idempotent=False,
         )
         await interaction.response.send_message(
             "Your report has successfully been sent. Thank you for your help!",
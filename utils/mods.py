@@ -1,9 +1,67 @@
+import asyncio
 import datetime
+import logging
+from utils.cache import ExpiringCache
 from utils.exceptions import AlreadyMuted, NotMuted
+from utils.singleflight import SingleFlight
 import discord
 
+log = logging.getLogger(__name__)
+
+# The permissions the Muted role is denied in every category and uncategorised channel.
+MUTED_OVERWRITE = dict(send_messages=False, connect=False)
+
+
+class ChannelActivity:
+    """The channels each member of the moderated guilds posted in recently, to only purge those.
+
+    The activity of a guild is only complete from the first message recorded in it, and from the last time an
+    entry had to be evicted to stay under `max_size`."""
+
+    def __init__(self, seconds=86400.0, max_size=50000):
+        self.seconds = seconds
+        # (guild id, user id) -> ids of the channels they posted in
+        self._channels = ExpiringCache(seconds=seconds, max_size=max_size)
+        # guild id -> since when its messages are recorded
+        self._since = {}
+        self._complete_since = discord.utils.utcnow()
+        self._evictions = 0
+
+    def record(self, message):
+        self._since.setdefault(message.guild.id, discord.utils.utcnow())
+        key = (message.guild.id, message.author.id)
+        channels = self._channels.get(key) or set()
+        channels.add(message.channel.id)
+        # Set again so the entry only expires once the member has been quiet for `seconds`.
+        self._channels[key] = channels
+        if self._channels.evictions != self._evictions:
+            self._evictions = self._channels.evictions
+            self._complete_since = discord.utils.utcnow()
+
+    def stop(self, guild_id):
+        self._since.pop(guild_id, None)
+
+    def channels(self, guild, user, after):
+        """The ids of the channels `user` posted in since `after`, None if that is not known."""
+        since = self._since.get(guild.id)
+        if since is None or max(since, self._complete_since) > after:
+            return None
+        if after < discord.utils.utcnow() - datetime.timedelta(seconds=self.seconds):
+            return None
+        try:
+            return self._channels[(guild.id, user.id)]
+        except KeyError:
+            return set()
+
 
 class ModUtils:
+    # Shared by every instance so concurrent mutes in a guild share one role setup, and purges share one limit.
+    _role_setups = SingleFlight()
+    _purge_semaphore = None
+    activity = ChannelActivity()
+    overwrite_concurrency = 5
+    purge_concurrency = 4
+
     def __init__(self, reason_format: str = "You have been $action from **$guild**\n```Reason: $reason```"):
         self.reason_format = reason_format
 
@@ -22,6 +80,45 @@ class ModUtils:
             )
         return role
 
+    @staticmethod
+    def muted_overwrite_targets(guild, role):
+        """The categories and uncategorised channels whose overwrite of the Muted role is not the expected one, and
+        that the bot can edit."""
+        channels = guild.categories + [c for c in guild.channels if c.category is None]
+        return [
+            c for c in channels
+            if c.permissions_for(guild.me).manage_roles
+            and any(getattr(c.overwrites_for(role), perm) is not value for perm, value in MUTED_OVERWRITE.items())
+        ]
+
+    async def sync_muted_overwrites(self, guild, role):
+        """Only update the overwrites that differ, a few channels at a time, returns how many were updated.
+
+        A channel that cannot be updated is skipped, it must not prevent the others from being updated."""
+        semaphore = asyncio.Semaphore(self.overwrite_concurrency)
+
+        async def apply(channel):
+            async with semaphore:
+                overwrite = channel.overwrites_for(role)
+                overwrite.update(**MUTED_OVERWRITE)
+                try:
+                    await channel.set_permissions(role, overwrite=overwrite)
+                except discord.HTTPException as e:
+                    log.warning(f"Could not update the Muted overwrite of channel {channel.id} in {guild.id}: {e!r}")
+                    return False
+                return True
+
+        targets = self.muted_overwrite_targets(guild, role)
+        results = await asyncio.gather(*(apply(c) for c in targets))
+        return sum(results)
+
+    async def get_muted_role(self, guild):
+        """Find or create the Muted role, concurrent calls for a guild share one lookup."""
+        return await self._role_setups.do(("role", guild.id), lambda: self.set_muted_role(guild))
+
+    async def setup_muted_overwrites(self, guild, role):
+        return await self._role_setups.do(("overwrites", guild.id), lambda: self.sync_muted_overwrites(guild, role))
+
     def format_sanction_reason(self, guild, reason, action):
         return self.reason_format.replace("$action", action).replace("$reason", reason).replace("$guild", guild.name)
 
@@ -55,7 +152,7 @@ class ModUtils:
 
     async def mute(self, member, reason=None, delete_last_day=False):
         if member.guild.get_member(member.id):
-            role = await self.set_muted_role(member.guild)
+            role = await self.get_muted_role(member.guild)
             if role in member.roles:
                 raise AlreadyMuted
             await member.add_roles(role, reason=reason)
@@ -63,8 +160,7 @@ class ModUtils:
                 await member.send(self.format_sanction_reason(member.guild, str(reason), "Muted"))
             except discord.HTTPException:
                 pass
-            for category in member.guild.categories + [c for c in member.guild.channels if c.category is None]:
-                await category.set_permissions(role, send_messages=False, connect=False)
+            await self.setup_muted_overwrites(member.guild, role)
             if delete_last_day:
                 await self.purge(member.guild.text_channels,
                                  after=discord.utils.utcnow() - datetime.timedelta(days=1),
@@ -73,8 +169,8 @@ class ModUtils:
 
     async def unmute(self, member, reason=None):
         if member.guild.get_member(member.id):
-            role = await self.set_muted_role(member.guild)
-            if role in member.roles:
+            role = discord.utils.get(member.guild.roles, name="Muted")
+            if role and role in member.roles:
                 await member.remove_roles(role, reason=reason)
                 try:
                     await member.send(self.format_sanction_reason(member.guild, str(reason), "Unmuted"))
@@ -82,14 +178,17 @@ class ModUtils:
                     pass
             else:
                 raise NotMuted
-            for category in member.guild.categories + [c for c in member.guild.channels if c.category is None]:
-                await category.set_permissions(role, send_messages=False, connect=False)
 
-    async def purge(self, channels, limit=None, after=None, user=None, original_message=None):
+    async def iter_purge(self, channels, limit=None, after=None, user=None, original_message=None):
+        """Purge the channels concurrently, yields (channel, deleted messages) as soon as each channel is done.
+
+        The channels that got no message after `after`, and the ones `user` is known not to have posted in, are
+        skipped. At most `purge_concurrency` channels are purged at once across every purge of the bot, discord.py
+        waiting out the per-channel rate limits."""
         if isinstance(channels, discord.abc.Messageable):
             channels = [channels]
-
-        total = []
+        if original_message and limit:
+            limit += 1
 
         def check(m):
             if not user and original_message:
@@ -100,16 +199,46 @@ class ModUtils:
                 return m.author.id == user.id and m.id != original_message.id
             return True
 
-        for channel in channels:
+        if after is not None:
+            after_id = discord.utils.time_snowflake(after)
+            channels = [c for c in channels if c.last_message_id is None or c.last_message_id > after_id]
+            if user and channels:
+                posted_in = self.activity.channels(channels[0].guild, user, after)
+                if posted_in is not None:
+                    channels = [c for c in channels if c.id in posted_in]
+
+        if ModUtils._purge_semaphore is None:
+            ModUtils._purge_semaphore = asyncio.Semaphore(self.purge_concurrency)
+
+        async def purge_channel(channel):
             bulk = True
             if (user and user.id == channel.guild.me.id and not channel.permissions_for(
                     channel.guild.get_member(channel.guild.me.id)
             ).manage_messages):
                 bulk = False
-            if original_message and limit:
-                limit += 1
-            try:
-                total += await channel.purge(limit=limit, check=check, after=after, bulk=bulk)
-            except discord.HTTPException:
-                pass
-        return total
\ No newline at end of file
+            async with self._purge_semaphore:
+                try:
+                    return channel, await channel.purge(limit=limit, check=check, after=after, bulk=bulk)
+                except discord.HTTPException:
+                    return channel, []
+
+        tasks = [asyncio.ensure_future(purge_channel(channel)) for channel in channels]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def purge(self, channels, limit=None, after=None, user=None, original_message=None, progress=None):
+        """Purge the channels and return every deleted message.
+
+        `progress` is called (or awaited) with the channel, how many messages were deleted in it and how many
+        were deleted so far, each time a channel is done."""
+        total = []
+        async for channel, deleted in self.iter_purge(channels, limit=limit, after=after, user=user,
+                                                      original_message=original_message):
+            total += deleted
+            if progress is not None:
+                await discord.utils.maybe_coroutine(progress, channel, len(deleted), len(total))
+        return total
@@ -1,19 +1,30 @@
 import time
-import waifuim
 import os
+from collections import OrderedDict
 
 import discord
+import waifuim
 from discord.ext import menus
 
+from utils.cache import ExpiringCache
 from utils.constants import APIDomainName
 from utils.modals import ReportModal, PagePrompterModal
-from utils.exceptions import NotAuthorized, LimitReached, UserBlacklisted, NotOwner
+from utils.exceptions import NotAuthorized, LimitReached, UserBlacklisted, NotOwner, UpstreamUnavailable
+from utils.singleflight import make_key
 
 
 def get_custom_id():
     return f"Ayane_{os.urandom(32).hex()}_author_check"
 
 
+def favorite_message(user, image_id, state):
+    mes = "**added to**" if state == "INSERTED" else "**removed from**"
+    return f"Alright **{user.name}**, the [image](https://{APIDomainName}/preview/{image_id}), " \
+           f"has successfully been {mes} your favorites.\n" \
+           f"You can look at your favorites [here](https://{APIDomainName}/fav/) " \
+           "after logging in with your discord account, or by using the `favorite` command. "
+
+
 class BaseSource(menus.ListPageSource):
     """Subclassing to change the way some method where coded
     (ex: get_max_pages not giving 'current' max pages)."""
@@ -36,6 +47,13 @@ class BaseSource(menus.ListPageSource):
 
 
 class ImageSource(BaseSource):
+    """Renders the embed of a page only when it is shown, the last few rendered embeds are memoised.
+
+    The footer depends on the position of the image so it is set at render time, removing an image does not
+    render anything."""
+
+    memo_size = 8
+
     def __init__(
             self,
             *,
@@ -45,26 +63,37 @@ class ImageSource(BaseSource):
             request_time=None,
             **kwargs,
     ):
-        self.image_info = image_info if hasattr(image_info, '__iter__') else [image_info]
+        self.image_info = list(image_info) if hasattr(image_info, '__iter__') else [image_info]
         self.title = title
         self.user = user
         self.request_time = request_time
-        self.many = len(self.image_info) > 1
-        embed_source = self.format_embeds()
-        super().__init__(embed_source, **kwargs)
+        # image id -> embed without its footer, least recently rendered first.
+        self._rendered = OrderedDict()
+        # The images are the entries, a page is rendered from its index.
+        super().__init__(self.image_info, **kwargs)
+
+    @property
+    def many(self):
+        return len(self.image_info) > 1
 
     def remove(self, index):
-        """remove a picture from the image source and re-format the embeds to display"""
-        del self.image_info[index]
-        self.many = len(self.image_info) > 1
-        self.entries = self.format_embeds()
+        """remove a picture from the image source"""
+        im = self.image_info.pop(index)
+        self._rendered.pop(im.image_id, None)
 
     def get_infos(self, index):
         return self.image_info[index]
 
-    def format_embeds(self):
-        embed_list = []
-        for i, im in enumerate(self.image_info):
+    async def get_page(self, page_number):
+        return page_number
+
+    async def format_page(self, menu, index):
+        return self.render(index)
+
+    def render(self, index):
+        im = self.image_info[index]
+        embed = self._rendered.get(im.image_id)
+        if embed is None:
             embed = discord.Embed(
                 url=im.url, colour=int(im.dominant_color.replace("#", ""), 16)
             )
@@ -73,15 +102,18 @@ class ImageSource(BaseSource):
                 url=im.preview_url,
             )
             embed.set_image(url=im.url)
-            text = f"Requested by {self.user.name}"
-            if self.request_time:
-                text += f" | {self.request_time}s"
-            if self.many:
-                text += f" | {i + 1}/{len(self.image_info)}"
-
-            embed.set_footer(text=text, icon_url=self.user.display_avatar.url)
-            embed_list.append(embed)
-        return embed_list
+            self._rendered[im.image_id] = embed
+            if len(self._rendered) > self.memo_size:
+                self._rendered.popitem(last=False)
+        else:
+            self._rendered.move_to_end(im.image_id)
+        text = f"Requested by {self.user.name}"
+        if self.request_time:
+            text += f" | {self.request_time}s"
+        if self.many:
+            text += f" | {index + 1}/{len(self.image_info)}"
+        embed.set_footer(text=text, icon_url=self.user.display_avatar.url)
+        return embed
 
 
 class BaseView(discord.ui.View):
@@ -126,6 +158,7 @@ class BaseView(discord.ui.View):
 
 
     async def stop_paginator(self, timed_out=False):
+        self.bot.views.remove(self)
         if (timed_out and not self.delete_after and self.message) or self.ephemeral:
             for it in self.children:
                 it.disabled = True
@@ -149,9 +182,9 @@ class BaseView(discord.ui.View):
                 child.custom_id = get_custom_id()
 
     async def interaction_check(self, interaction):
-        reason = await self.bot.is_blacklisted(interaction.user)
+        reason = self.bot.is_blacklisted(interaction.user)
         if reason:
-            raise UserBlacklisted(interaction.user, reason=reason[0])
+            raise UserBlacklisted(interaction.user, reason=reason)
         custom_id = str(interaction.data.get("custom_id"))
         if (
                 custom_id.endswith("author_check")
@@ -174,7 +207,9 @@ class BaseView(discord.ui.View):
 
     async def send_view(self, *args, **kwargs):
         self.init_custom_id()
-        return await self.send_message(*args, **kwargs, ephemeral=self.ephemeral, view=self)
+        message = await self.send_message(*args, **kwargs, ephemeral=self.ephemeral, view=self)
+        self.bot.views.add(self)
+        return message
 
     async def on_timeout(self):
         await self.stop_paginator(timed_out=True)
@@ -208,6 +243,9 @@ class BaseView(discord.ui.View):
         elif isinstance(error, UserBlacklisted):
             embed = discord.Embed(title="🛑 Forbidden", colour=self.bot.colour, description=str(error))
             await self.bot.send_interaction_error_message(interaction, embed=embed, ephemeral=True)
+        elif isinstance(error, UpstreamUnavailable):
+            embed = discord.Embed(title="🛑 Service unavailable", colour=self.bot.colour, description=str(error))
+            await self.bot.send_interaction_error_message(interaction, embed=embed, ephemeral=True)
         else:
             await self.bot.send_unexpected_error(interaction, error, command=self.main_interaction.command,
                                                  ephemeral=True)
@@ -411,12 +449,15 @@ class ImageMenu(ViewMenu):
             usersdict[user.id] += 1
 
     async def edit_fav(self, filename, image_id, user):
-        t = await self.bot.waifu_client.fav_toggle(user_id=user.id, image_id=image_id)
-        mes = "**added to**" if t["state"] == "INSERTED" else "**removed from**"
-        return f"Alright **{user.name}**, the [image](https://{APIDomainName}/preview/{image_id}), " \
-               f"has successfully been {mes} your favorites.\n" \
-               f"You can look at your favorites [here](https://{APIDomainName}/fav/) " \
-               "after logging in with your discord account, or by using the `favorite` command. "
+        t = await self.bot.waifu_gateway.call(
+            lambda: self.bot.waifu_client.fav_toggle(user_id=user.id, image_id=image_id),
+            idempotent=False,
+        )
+        if self.image_info.image_id == image_id:
+            self.bot.favorites.toggled(user.id, self.image_info, t["state"])
+        else:
+            self.bot.favorites.discard(user.id)
+        return favorite_message(user, image_id, t["state"])
 
     @discord.ui.button(emoji="⚠", label="Report", style=discord.ButtonStyle.grey, custom_id="True", )
     async def report(self, interaction: discord.Interaction, button: discord.ui.Button):
@@ -461,18 +502,16 @@ class ImageMenu(ViewMenu):
         )
         await interaction.response.defer(ephemeral=True)
         try:
-            rq = await self.bot.waifu_client.search(included_tags=[self.image_info.image_id])
-            self.image_info = self.source.image_infos[self.current_page] = rq[0]
+            image_id = self.image_info.image_id
+            rq = await self.bot.waifu_gateway.call(
+                lambda: self.bot.waifu_client.search(included_tags=[image_id]),
+                key=make_key("waifu.im search", included_tags=[image_id]),
+            )
+            self.image_info = self.source.image_info[self.current_page] = rq[0]
         except:
             pass
         image_id = self.image_info.image_id
-        in_fav = False
-        try:
-            favs = await self.bot.waifu_client.fav(user_id=interaction.user.id)
-            in_fav = any(im.image_id == image_id for im in favs)
-        except waifuim.exceptions.APIException as e:
-            if e.status != 404:
-                raise e
+        in_fav = await self.bot.favorites.contains(interaction.user.id, image_id)
         number_fav = self.image_info.favorites
         sd_part = "If the image doesn't have any source, and you really want it," \
                   "please use **[Saucenao](https://saucenao.com/)**," \
@@ -510,3 +549,196 @@ class FavMenu(ImageMenu):
             if not self.source.entries:
                 await self.stop_paginator()
             await self.show_checked_page(self.current_page)
+
+
+STATELESS_PREFIX = "Ayane:p"
+FAVORITES_FILTERS = {"a": None, "n": True, "s": False}
+
+
+def favorites_title(user, is_nsfw):
+    return user.name + "'s " + ("NSFW " if is_nsfw is True else "SFW " if is_nsfw is False else "") + "favorites"
+
+
+class StatelessImageMenu:
+    """Image paginator that keeps no view alive once sent.
+
+    The state of the menu lives in the custom_id of its buttons: `Ayane:p:<kind>:<handle>:<owner id>:<page>:<action>`
+    where `kind` is `r` for results kept in the bot `ResultStore` under `handle` and `f` for the favorites of the
+    owner, `handle` being then the nsfw filter. The clicks are handled by the `PaginatorDispatcher`, so favorites
+    menus keep working after a restart while the results menus expire with their store entry."""
+
+    actions = (
+        ("first", "<:first_track:840584439830544434>"),
+        ("previous", "<:before_track:840584439817699348>"),
+        ("next", "<:next_track:840584439813242951>"),
+        ("last", "<:last_track:840584439813373972>"),
+    )
+
+    def __init__(self, *, source, main_interaction, ephemeral=False, favorites_filter=None):
+        self.source = source
+        self.main_interaction = main_interaction
+        self.bot = main_interaction.client
+        self.ephemeral = ephemeral
+        self.favorites_filter = favorites_filter
+
+    @staticmethod
+    def custom_id(kind, handle, owner_id, page, action):
+        return f"{STATELESS_PREFIX}:{kind}:{handle}:{owner_id}:{page}:{action}"
+
+    @classmethod
+    def build_view(cls, kind, handle, owner_id, page, max_pages):
+        view = discord.ui.View(timeout=None)
+        if max_pages > 1:
+            targets = dict(first=0, previous=page - 1, next=page + 1, last=max_pages - 1)
+            for action, emoji in cls.actions:
+                target = targets[action]
+                view.add_item(discord.ui.Button(
+                    emoji=emoji,
+                    style=discord.ButtonStyle.grey,
+                    custom_id=cls.custom_id(kind, handle, owner_id, target, action),
+                    disabled=not 0 <= target < max_pages or target == page,
+                ))
+        row = 1 if max_pages > 1 else None
+        view.add_item(discord.ui.Button(emoji="❤", style=discord.ButtonStyle.grey, row=row,
+                                        custom_id=cls.custom_id(kind, handle, owner_id, page, "fav")))
+        view.add_item(discord.ui.Button(emoji="<:dust_bin:825400669867081818>", style=discord.ButtonStyle.grey,
+                                        row=row, custom_id=cls.custom_id(kind, handle, owner_id, page, "delete")))
+        # A view that is not finished would be kept in the view store, which is what this menu avoids.
+        view.stop()
+        return view
+
+    async def start(self):
+        owner_id = self.main_interaction.user.id
+        if self.favorites_filter is not None:
+            kind, handle = "f", self.favorites_filter
+        else:
+            kind = "r"
+            handle = self.bot.paginator_dispatcher.results.put(
+                dict(title=self.source.title, images=self.source.image_info, request_time=self.source.request_time)
+            )
+        view = self.build_view(kind, handle, owner_id, 0, self.source.get_max_pages())
+        embed = self.source.render(0)
+        if self.main_interaction.response.is_done():
+            return await self.main_interaction.followup.send(embed=embed, view=view, ephemeral=self.ephemeral)
+        return await self.main_interaction.response.send_message(embed=embed, view=view, ephemeral=self.ephemeral)
+
+
+class ResultStore:
+    """The results shown by the stateless menus, referenced by a short random handle."""
+
+    def __init__(self, seconds=3600.0, max_size=2000):
+        self._results = ExpiringCache(seconds=seconds, max_size=max_size)
+
+    def put(self, result):
+        handle = os.urandom(4).hex()
+        self._results[handle] = result
+        return handle
+
+    def get(self, handle):
+        return self._results.get(handle)
+
+    def stats(self):
+        return self._results.stats()
+
+
+class PaginatorDispatcher:
+    """Handles the clicks on every `StatelessImageMenu` button, registered as an `on_interaction` listener."""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.results = ResultStore()
+        self.clicks = 0
+        self.expired = 0
+
+    def stats(self):
+        return dict(clicks=self.clicks, expired=self.expired, **self.results.stats())
+
+    async def resolve_owner(self, interaction, owner_id):
+        """The owner of a menu, which may not be the user clicking it."""
+        if interaction.user.id == owner_id:
+            return interaction.user
+        owner = (interaction.guild and interaction.guild.get_member(owner_id)) or self.bot.get_user(owner_id)
+        if owner is None:
+            try:
+                owner = await self.bot.fetch_user(owner_id)
+            except discord.HTTPException:
+                owner = interaction.user
+        return owner
+
+    async def load(self, kind, handle, owner):
+        """Return the source of a menu, or None if its results expired."""
+        if kind == "f":
+            is_nsfw = FAVORITES_FILTERS[handle]
+            images = await self.bot.favorites.images(owner.id, is_nsfw=is_nsfw)
+            title, request_time = favorites_title(owner, is_nsfw), None
+        else:
+            result = self.results.get(handle)
+            if result is None:
+                return None
+            images, title, request_time = result["images"], result["title"], result["request_time"]
+        if not images:
+            return None
+        return ImageSource(title=title, image_info=images, user=owner, request_time=request_time, per_page=1)
+
+    async def on_interaction(self, interaction):
+        if interaction.type is not discord.InteractionType.component:
+            return
+        custom_id = str(interaction.data.get("custom_id"))
+        if not custom_id.startswith(STATELESS_PREFIX + ":"):
+            return
+        self.clicks += 1
+        _, _, kind, handle, owner_id, page, action = custom_id.split(":")
+        owner_id, page = int(owner_id), int(page)
+        reason = self.bot.is_blacklisted(interaction.user)
+        if reason:
+            return await interaction.response.send_message(
+                str(UserBlacklisted(interaction.user, reason=reason)), ephemeral=True
+            )
+        if interaction.user.id != owner_id and interaction.user.id not in {self.bot.owner_id, *self.bot.owner_ids}:
+            return await interaction.response.send_message(
+                f"Only <@{owner_id}> can use this menu.", ephemeral=True
+            )
+        # Loading the favorites or toggling one may take longer than the interaction deadline.
+        await interaction.response.defer()
+        if action == "delete":
+            if interaction.message.flags.ephemeral:
+                return await interaction.edit_original_response(view=None)
+            return await interaction.message.delete()
+        try:
+            owner = await self.resolve_owner(interaction, owner_id)
+            source = await self.load(kind, handle, owner)
+            message = None
+            if source is not None and action == "fav":
+                page = min(page, source.get_max_pages() - 1)
+                image = source.image_info[page]
+                t = await self.bot.waifu_gateway.call(
+                    lambda: self.bot.waifu_client.fav_toggle(user_id=interaction.user.id, image_id=image.image_id),
+                    idempotent=False,
+                )
+                self.bot.favorites.toggled(interaction.user.id, image, t["state"])
+                message = favorite_message(interaction.user, image.image_id, t["state"])
+                if kind == "f" and owner.id == interaction.user.id:
+                    # The image left the favorites, show the one that took its place.
+                    source = await self.load(kind, handle, owner)
+                    if source is None:
+                        await interaction.edit_original_response(content="No favorites left.", embed=None, view=None)
+                        return await interaction.followup.send(
+                            embed=discord.Embed(description=message, color=discord.Colour.random()), ephemeral=True
+                        )
+        except UpstreamUnavailable as e:
+            return await interaction.followup.send(str(e), ephemeral=True)
+        except waifuim.APIException as e:
+            return await interaction.followup.send(f"waifu.im could not process this request: {e.detail}",
+                                                   ephemeral=True)
+        if source is None:
+            self.expired += 1
+            return await interaction.edit_original_response(
+                content="This menu has expired, please run the command again.", embed=None, view=None
+            )
+        page = max(0, min(page, source.get_max_pages() - 1))
+        view = StatelessImageMenu.build_view(kind, handle, owner_id, page, source.get_max_pages())
+        await interaction.edit_original_response(embed=source.render(page), view=view)
+        if message:
+            await interaction.followup.send(
+                embed=discord.Embed(description=message, color=discord.Colour.random()), ephemeral=True
+            )
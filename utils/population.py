@@ -0,0 +1,53 @@
+class GuildPopulation:
+    """Per-guild bot and human counters, built once from the member cache then kept up to date from the member
+    join/remove events so reading them never walks the member list.
+
+    Only the chunked guilds are counted: the member cache of the others holds little more than the bot itself, which
+    would make every one of them look like a bot farm."""
+
+    def __init__(self):
+        # guild id -> [bots, humans]
+        self._counts = {}
+
+    def __contains__(self, guild_id):
+        return guild_id in self._counts
+
+    def __len__(self):
+        return len(self._counts)
+
+    def add_guild(self, guild):
+        if not guild.chunked:
+            self._counts.pop(guild.id, None)
+            return
+        bots = sum(1 for m in guild.members if m.bot)
+        self._counts[guild.id] = [bots, len(guild.members) - bots]
+
+    def remove_guild(self, guild_id):
+        self._counts.pop(guild_id, None)
+
+    def rebuild(self, guilds):
+        self._counts.clear()
+        for guild in guilds:
+            self.add_guild(guild)
+
+    def member_join(self, member):
+        counts = self._counts.get(member.guild.id)
+        if counts is None:
+            return self.add_guild(member.guild)
+        counts[0 if member.bot else 1] += 1
+
+    def member_remove(self, member):
+        counts = self._counts.get(member.guild.id)
+        if counts is None:
+            return
+        index = 0 if member.bot else 1
+        counts[index] = max(counts[index] - 1, 0)
+
+    def get(self, guild_id):
+        """Return the (bots, humans) counts of the guild, (0, 0) if it is not counted."""
+        bots, humans = self._counts.get(guild_id, (0, 0))
+        return bots, humans
+
+    def items(self):
+        for guild_id, (bots, humans) in self._counts.items():
+            yield guild_id, bots, humans
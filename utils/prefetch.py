@@ -0,0 +1,108 @@
+import asyncio
+import contextlib
+import logging
+import time
+from collections import Counter, OrderedDict, deque
+
+log = logging.getLogger(__name__)
+
+
+class PrefetchPool:
+    """Per-key pools of pre-fetched results served without waiting for the upstream.
+
+    `fetch` is a coroutine function taking a key and returning a batch of results. A pool is refilled in the
+    background once it holds `low_watermark` results or less, and results older than `ttl` seconds are dropped.
+    Every result is served once. Concurrent callers hitting an empty pool share the same refill."""
+
+    def __init__(self, fetch, *, ttl=600.0, low_watermark=5, max_keys=128):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.low_watermark = low_watermark
+        self.max_keys = max_keys
+        # key -> deque of (fetched at, result), least recently used key first
+        self._pools = OrderedDict()
+        self._refills = {}
+        # Per-key counters only cover the pooled keys, the totals cover every key.
+        self.hits = Counter()
+        self.misses = Counter()
+        self.total_hits = 0
+        self.total_misses = 0
+
+    def _pool(self, key):
+        pool = self._pools.get(key)
+        if pool is None:
+            pool = self._pools[key] = deque()
+            while len(self._pools) > self.max_keys:
+                evicted, _ = self._pools.popitem(last=False)
+                self.hits.pop(evicted, None)
+                self.misses.pop(evicted, None)
+        else:
+            self._pools.move_to_end(key)
+        expired_before = time.monotonic() - self.ttl
+        while pool and pool[0][0] < expired_before:
+            pool.popleft()
+        return pool
+
+    def _pop(self, key, pool):
+        result = pool.popleft()[1]
+        if len(pool) <= self.low_watermark:
+            self.refill(key)
+        return result
+
+    async def get(self, key):
+        """Return a pre-fetched result for `key`, or None if none could be fetched."""
+        pool = self._pool(key)
+        if pool:
+            self.hits[key] += 1
+            self.total_hits += 1
+            return self._pop(key, pool)
+        self.misses[key] += 1
+        self.total_misses += 1
+        with contextlib.suppress(Exception):
+            await self.refill(key)
+        pool = self._pool(key)
+        if pool:
+            return self._pop(key, pool)
+        return None
+
+    def refill(self, key):
+        task = self._refills.get(key)
+        if task is None or task.done():
+            task = self._refills[key] = asyncio.create_task(self._refill(key))
+            task.add_done_callback(lambda t: self._refill_done(key, t))
+        return task
+
+    async def _refill(self, key):
+        results = await self.fetch(key)
+        now = time.monotonic()
+        # The key may have been evicted while fetching, do not bring it back for a result nobody asked for yet.
+        pool = self._pools.get(key)
+        if pool is not None:
+            pool.extend((now, result) for result in results)
+
+    def _refill_done(self, key, task):
+        if self._refills.get(key) is task:
+            del self._refills[key]
+        if not task.cancelled() and task.exception() is not None:
+            log.debug(f"Prefetch refill failed: {task.exception()!r}")
+
+    def key_stats(self):
+        """Hit rate and pool size of every key, most requested first."""
+        keys = sorted(set(self.hits) | set(self.misses), key=lambda k: -(self.hits[k] + self.misses[k]))
+        return {
+            key: dict(
+                size=len(self._pools.get(key, ())),
+                hit_rate=round(self.hits[key] / (self.hits[key] + self.misses[key]), 2),
+            )
+            for key in keys
+        }
+
+    def stats(self):
+        hits, misses = self.total_hits, self.total_misses
+        return dict(
+            keys=len(self._pools),
+            pooled=sum(len(pool) for pool in self._pools.values()),
+            hits=hits,
+            misses=misses,
+            hit_rate=round(hits / (hits + misses), 2) if hits + misses else None,
+        )
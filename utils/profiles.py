@@ -0,0 +1,105 @@
+import discord
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+class RuntimeProfile:
+    """The gateway and cache settings the bot is started with.
+
+    When `lazy_chunking` is set the guilds are not chunked at startup, only the guilds that have moderation features
+    turned on get chunked once the bot is ready."""
+
+    def __init__(self, name, intents, member_cache_flags, chunk_guilds_at_startup, max_messages, lazy_chunking):
+        self.name = name
+        self.intents = intents
+        self.member_cache_flags = member_cache_flags
+        self.chunk_guilds_at_startup = chunk_guilds_at_startup
+        self.max_messages = max_messages
+        self.lazy_chunking = lazy_chunking
+
+    def client_options(self):
+        return dict(
+            intents=self.intents,
+            member_cache_flags=self.member_cache_flags,
+            chunk_guilds_at_startup=self.chunk_guilds_at_startup,
+            max_messages=self.max_messages,
+        )
+
+
+def full_profile():
+    """Every intent but typing and every member cached, this is how the bot always used to run."""
+    intents = discord.Intents.all()
+    intents.typing = False  # noqa
+    intents.dm_typing = False  # noqa
+    return RuntimeProfile(
+        "full",
+        intents,
+        discord.MemberCacheFlags.from_intents(intents),
+        chunk_guilds_at_startup=True,
+        max_messages=1000,
+        lazy_chunking=False,
+    )
+
+
+def moderation_profile():
+    """No presences, which are most of the gateway traffic and unused by the cogs, and only the guilds with
+    moderation features are chunked."""
+    intents = discord.Intents.all()
+    intents.presences = False  # noqa
+    intents.typing = False  # noqa
+    intents.dm_typing = False  # noqa
+    return RuntimeProfile(
+        "moderation",
+        intents,
+        discord.MemberCacheFlags.from_intents(intents),
+        chunk_guilds_at_startup=False,
+        max_messages=1000,
+        lazy_chunking=True,
+    )
+
+
+def lean_profile():
+    """The least the cogs need: member joins for the anti-spam, message content for the prefix commands and the
+    voice states for the automove. Only members in voice channels or that joined since startup are cached and
+    there is no message cache."""
+    intents = discord.Intents.default()
+    intents.members = True  # noqa
+    intents.message_content = True  # noqa
+    intents.typing = False  # noqa
+    intents.dm_typing = False  # noqa
+    member_cache_flags = discord.MemberCacheFlags.none()
+    member_cache_flags.voice = True
+    member_cache_flags.joined = True
+    return RuntimeProfile(
+        "lean",
+        intents,
+        member_cache_flags,
+        chunk_guilds_at_startup=False,
+        max_messages=None,
+        lazy_chunking=True,
+    )
+
+
+profiles = {
+    "full": full_profile,
+    "moderation": moderation_profile,
+    "lean": lean_profile,
+}
+
+
+def get_profile(name):
+    try:
+        return profiles[name]()
+    except KeyError:
+        raise ValueError(f"Unknown runtime profile {name!r}, expected one of {', '.join(profiles)}") from None
+
+
+def memory_usage():
+    """The peak resident memory of the process, formatted in MiB."""
+    if resource is None:
+        return None
+    # ru_maxrss is in KiB on Linux.
+    return f"{resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f}MiB"
@@ -0,0 +1,65 @@
+import logging
+
+log = logging.getLogger(__name__)
+
+MISSING = object()
+
+
+class GuildSettingsCache:
+    """Write-through cache of the `registered_guild` settings.
+
+    Every registered guild is loaded in bulk with `load`, after that a guild missing from the cache is known to be
+    unregistered and gets a negative entry instead of being looked up. The settings must only be written through
+    `set_anti_spam_mode` so the cache stays in sync with the database."""
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.loaded = False
+        self.hits = 0
+        self.misses = 0
+        self._anti_spam_modes = {}
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses, guilds=len(self._anti_spam_modes))
+
+    async def load(self):
+        records = await self.pool.fetch("SELECT id, anti_spam_mode FROM registered_guild")
+        self._anti_spam_modes = {r["id"]: r["anti_spam_mode"] for r in records}
+        self.loaded = True
+        log.info(f"Loaded the settings of {len(self._anti_spam_modes)} guilds.")
+
+    def get_anti_spam_mode(self, guild_id):
+        """Return the cached anti-spam mode of the guild, or `MISSING` if it has to be fetched."""
+        try:
+            mode = self._anti_spam_modes[guild_id]
+        except KeyError:
+            self.misses += 1
+            if not self.loaded:
+                return MISSING
+            # The bulk load already went through every registered guild, so this one is not registered.
+            mode = self._anti_spam_modes[guild_id] = None
+            return mode
+        self.hits += 1
+        return mode
+
+    async def fetch_anti_spam_mode(self, guild_id):
+        mode = await self.pool.fetchval("SELECT anti_spam_mode FROM registered_guild WHERE id=$1", guild_id)
+        self._anti_spam_modes[guild_id] = mode
+        return mode
+
+    async def set_anti_spam_mode(self, guild, mode):
+        await self.pool.execute(
+            "INSERT INTO registered_guild (id,name,anti_spam_mode)"
+            "VALUES ($1,$2,$3) ON CONFLICT (id) DO UPDATE SET name=$2,anti_spam_mode=$3",
+            guild.id,
+            guild.name,
+            mode,
+        )
+        self._anti_spam_modes[guild.id] = mode
+
+    def discard(self, guild_id):
+        """Forget the cached settings of a guild, they are fetched again if it is seen again.
+
+        The guild row is kept in the database, so the guild must not be mistaken for an unregistered one."""
+        if guild_id in self._anti_spam_modes:
+            self._anti_spam_modes[guild_id] = MISSING
@@ -0,0 +1,50 @@
+import asyncio
+
+
+def normalize(value):
+    """Turn a request parameter into a hashable value that is the same for equivalent requests."""
+    if isinstance(value, str):
+        return value.strip().lower()
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return tuple(sorted(normalize(v) for v in value))
+    if isinstance(value, dict):
+        return tuple(sorted((k, normalize(v)) for k, v in value.items()))
+    return value
+
+
+def make_key(name, **params):
+    return (name,) + normalize(params)
+
+
+class SingleFlight:
+    """Coalesces identical concurrent calls so they share one in-flight call.
+
+    The callers waiting on a call get the same result (or exception), unless a `fan_out` function is given, in
+    which case each caller gets `fan_out(result)`, e.g. a copy of a list it may mutate."""
+
+    def __init__(self):
+        self._calls = {}
+        self.calls = 0
+        self.shared = 0
+
+    def stats(self):
+        return dict(in_flight=len(self._calls), calls=self.calls, shared=self.shared)
+
+    async def do(self, key, factory, *, fan_out=None):
+        future = self._calls.get(key)
+        if future is None:
+            future = self._calls[key] = asyncio.ensure_future(factory())
+            future.add_done_callback(lambda f: self._done(key, f))
+            self.calls += 1
+        else:
+            self.shared += 1
+        # A caller being cancelled must not cancel the call the others are waiting for.
+        result = await asyncio.shield(future)
+        return fan_out(result) if fan_out is not None else result
+
+    def _done(self, key, future):
+        if self._calls.get(key) is future:
+            del self._calls[key]
+        # Retrieve the exception so it is not reported as never retrieved when every caller was cancelled.
+        if not future.cancelled():
+            future.exception()
@@ -0,0 +1,66 @@
+from collections import Counter
+
+import discord
+
+
+def channel_kind(channel):
+    if isinstance(channel, discord.TextChannel):
+        return "text"
+    elif isinstance(channel, discord.VoiceChannel):
+        return "voice"
+    elif isinstance(channel, discord.StageChannel):
+        return "stage"
+    return "other"
+
+
+class BotStatistics:
+    """Guild, user and channel counts of the bot, kept up to date from the gateway events so reading them never
+    walks every guild or channel. `users` is the sum of the member counts of the guilds."""
+
+    def __init__(self):
+        self.guilds = 0
+        self.users = 0
+        self.channels = Counter()
+
+    def rebuild(self, guilds):
+        self.guilds = 0
+        self.users = 0
+        self.channels.clear()
+        for guild in guilds:
+            self.add_guild(guild)
+
+    def add_guild(self, guild):
+        self.guilds += 1
+        self.users += guild.member_count or 0
+        self.channels.update(channel_kind(c) for c in guild.channels)
+
+    def remove_guild(self, guild):
+        self.guilds = max(self.guilds - 1, 0)
+        self.users = max(self.users - (guild.member_count or 0), 0)
+        self.channels.subtract(channel_kind(c) for c in guild.channels)
+
+    def add_channel(self, channel):
+        self.channels[channel_kind(channel)] += 1
+
+    def remove_channel(self, channel):
+        self.channels[channel_kind(channel)] -= 1
+
+    def update_channel(self, before, after):
+        if channel_kind(before) != channel_kind(after):
+            self.remove_channel(before)
+            self.add_channel(after)
+
+    def member_join(self, member):
+        self.users += 1
+
+    def member_remove(self, member):
+        self.users = max(self.users - 1, 0)
+
+    def snapshot(self):
+        return dict(
+            guilds=self.guilds,
+            users=self.users,
+            text_channels=self.channels["text"],
+            voice_channels=self.channels["voice"],
+            stage_channels=self.channels["stage"],
+        )
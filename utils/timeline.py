@@ -0,0 +1,39 @@
+import contextlib
+import logging
+import time
+
+log = logging.getLogger(__name__)
+
+
+class StartupTimeline:
+    """Records how long each startup step took, relative to when the timeline was created."""
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        # (label, started after, duration, failed)
+        self.steps = []
+
+    @contextlib.contextmanager
+    def measure(self, label):
+        start = time.perf_counter()
+        failed = False
+        try:
+            yield
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            self.steps.append((label, start - self.origin, time.perf_counter() - start, failed))
+
+    def mark(self, label):
+        """Record an instant event, like the bot becoming ready."""
+        self.steps.append((label, time.perf_counter() - self.origin, 0.0, False))
+
+    def format(self):
+        lines = []
+        for label, started_after, duration, failed in sorted(self.steps, key=lambda s: s[1]):
+            lines.append(f"+{started_after:7.2f}s {duration:7.2f}s {label}{' (failed)' if failed else ''}")
+        return "\n".join(lines)
+
+    def log(self):
+        log.info("Startup timeline:\n" + self.format())
@@ -0,0 +1,115 @@
+import bisect
+import math
+import re
+from collections import Counter
+
+_not_word = re.compile(r"[\W_]+")
+# The trigram similarity a title needs to match a query.
+MIN_SIMILARITY = 0.3
+
+
+def normalize_title(title):
+    return _not_word.sub(" ", title.lower()).strip()
+
+
+def trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TitleIndex:
+    """Titles of the AniList medias seen so far, to resolve a search to a media id without calling AniList.
+
+    Every romaji, english and native title and every synonym of a media is indexed. Short queries are matched by
+    prefix with a binary search over the sorted titles, longer ones by the trigrams they share with the titles.
+    At most `max_medias` medias are indexed, the ones seen after that are ignored, and only the `max_candidates`
+    titles sharing the most trigrams with a query are scored."""
+
+    def __init__(self, max_medias=20000, max_candidates=200):
+        self.max_medias = max_medias
+        self.max_candidates = max_candidates
+        # media id -> (display title, is adult)
+        self.medias = {}
+        # normalized title -> media ids
+        self._titles = {}
+        self._sorted = []
+        # trigram -> normalized titles
+        self._trigrams = {}
+        # normalized title -> number of distinct trigrams it has
+        self._trigram_counts = {}
+
+    def __len__(self):
+        return len(self.medias)
+
+    def add(self, media):
+        if media.id not in self.medias and len(self.medias) >= self.max_medias:
+            return
+        titles = [t for t in (media.title or {}).values() if t]
+        titles += [t for t in (getattr(media, "synonyms", None) or []) if t]
+        if not titles:
+            return
+        display = media.title.get("english") or media.title.get("romaji") or titles[0]
+        self.medias[media.id] = (display, bool(media.is_adult))
+        for title in titles:
+            normalized = normalize_title(title)
+            if not normalized:
+                continue
+            ids = self._titles.get(normalized)
+            if ids is None:
+                ids = self._titles[normalized] = set()
+                bisect.insort(self._sorted, normalized)
+                grams = trigrams(normalized)
+                self._trigram_counts[normalized] = len(grams)
+                for gram in grams:
+                    self._trigrams.setdefault(gram, set()).add(normalized)
+            ids.add(media.id)
+
+    def exact(self, name):
+        """The media id of the title `name` if only one media has it."""
+        ids = self._titles.get(normalize_title(name))
+        if ids and len(ids) == 1:
+            return next(iter(ids))
+        return None
+
+    def _prefix(self, query):
+        start = bisect.bisect_left(self._sorted, query)
+        end = bisect.bisect_right(self._sorted, query + "\uffff")
+        return self._sorted[start:end]
+
+    def search(self, query, *, allow_adult=True, limit=25):
+        """The (media id, display title) pairs best matching `query`."""
+        query = normalize_title(query)
+        if not query:
+            return []
+        scores = Counter()
+        for title in self._prefix(query):
+            scores[title] += 2.0
+        if len(query) >= 3:
+            grams = trigrams(query)
+            # A title this similar shares at least `needed` trigrams with the query, so it is in at least one of the
+            # lists left once the `needed - 1` largest are put aside. Those only count for the titles already found.
+            needed = max(1, math.ceil(MIN_SIMILARITY * len(grams)))
+            lists = sorted((self._trigrams.get(gram, frozenset()) for gram in grams), key=len)
+            split = len(lists) - needed + 1
+            shared = Counter()
+            for titles in lists[:split]:
+                shared.update(titles)
+            candidates = set(shared)
+            for titles in lists[split:]:
+                shared.update(titles & candidates)
+            for title, count in shared.most_common(self.max_candidates):
+                # Jaccard similarity, the union being both sets minus what they share.
+                score = count / (len(grams) + self._trigram_counts[title] - count)
+                if score >= MIN_SIMILARITY:
+                    scores[title] += score
+        results, seen = [], set()
+        for title, _ in scores.most_common():
+            for media_id in self._titles[title]:
+                display, is_adult = self.medias[media_id]
+                if media_id in seen or (is_adult and not allow_adult):
+                    continue
+                seen.add(media_id)
+                results.append((media_id, display))
+                if len(results) >= limit:
+                    return results
+        return results
@@ -86,6 +86,10 @@ class AyaneCommandTree(app_commands.CommandTree):
             embed.title = "🛑 Forbidden",
             embed.description = "Sorry I dont have enough permissions to do this."
             await interaction.client.send_interaction_error_message(interaction, embed=embed)
+        elif isinstance(error, exceptions.UpstreamUnavailable):
+            embed.title = "🛑 Service unavailable"
+            embed.description = str(error)
+            await interaction.client.send_interaction_error_message(interaction, embed=embed)
         elif isinstance(error, app_commands.TransformerError):
             embed.title = "🛑 Bad Argument"
             embed.description = str(error)
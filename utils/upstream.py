@@ -0,0 +1,194 @@
+import asyncio
+import random
+import time
+
+import aiohttp
+
+from utils.exceptions import UpstreamUnavailable
+
+
+class TokenBucket:
+    """Spaces out the requests to stay under `rate` requests per second with bursts of up to `capacity`.
+
+    The bucket can be paused, e.g. after a 429, and is corrected from the rate-limit headers when they are known."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def update_from_headers(self, headers):
+        """Adjust the bucket from the X-RateLimit-* and Retry-After headers of a response."""
+        remaining = headers.get("X-RateLimit-Remaining")
+        if remaining is not None:
+            try:
+                self._refill()
+                self.tokens = min(self.tokens, float(remaining))
+            except ValueError:
+                pass
+        retry_after = headers.get("Retry-After")
+        if retry_after is not None:
+            try:
+                self.pause(float(retry_after))
+            except ValueError:
+                pass
+
+
+class CircuitBreaker:
+    """Fails fast once the upstream failed `failure_threshold` times in a row, for `reset_timeout` seconds.
+
+    After that one trial call is let through: the breaker closes again if it succeeds and reopens if it fails."""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+        self.trial_started = 0.0
+        self.trips = 0
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        state = self.state
+        if state == "closed":
+            return True
+        # A trial call that never reported back (e.g. cancelled) must not keep the breaker half-open forever.
+        if state == "half-open" and (not self.trial or time.monotonic() - self.trial_started >= self.reset_timeout):
+            self.trial = True
+            self.trial_started = time.monotonic()
+            return True
+        return False
+
+    def retry_after(self):
+        if self.opened_at is None:
+            return 0.0
+        return max(self.opened_at + self.reset_timeout - time.monotonic(), 0.0)
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.trial or self.failures >= self.failure_threshold:
+            if self.opened_at is None or self.trial:
+                self.trips += 1
+            self.opened_at = time.monotonic()
+            self.trial = False
+
+
+class UpstreamGateway:
+    """Every call to an upstream API (waifu.im, AniList) goes through its gateway.
+
+    Calls wait for a token of the bucket, 429s are retried after the Retry-After delay (or a jittered backoff),
+    server errors and connection errors are retried with a jittered backoff and count towards the circuit breaker.
+    While the breaker is open the calls fail fast with `UpstreamUnavailable`. When a `key` is given, identical
+    concurrent calls are coalesced with `single_flight`. Calls that are not idempotent (e.g. a favorite toggle) must
+    pass `idempotent=False`: a timeout or a server error may happen after the upstream applied them, so they are
+    never retried except on 429s, which are rejected before being applied."""
+
+    def __init__(self, name, *, rate, capacity, single_flight=None, retries=3, base_delay=0.25, max_delay=8.0,
+                 failure_threshold=5, reset_timeout=30.0):
+        self.name = name
+        self.bucket = TokenBucket(rate, capacity)
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.single_flight = single_flight
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.calls = 0
+        self.retried = 0
+        self.rejected = 0
+
+    def stats(self):
+        return dict(
+            state=self.breaker.state,
+            calls=self.calls,
+            retried=self.retried,
+            rejected=self.rejected,
+            trips=self.breaker.trips,
+            tokens=round(self.bucket.tokens, 1),
+        )
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    @staticmethod
+    def is_server_error(error):
+        if isinstance(error, (aiohttp.ClientConnectionError, asyncio.TimeoutError)):
+            return True
+        status = getattr(error, "status", None)
+        return isinstance(status, int) and status >= 500
+
+    async def call(self, factory, *, key=None, fan_out=None, idempotent=True):
+        if key is not None and self.single_flight is not None:
+            return await self.single_flight.do(
+                (self.name,) + key, lambda: self._call(factory, idempotent), fan_out=fan_out
+            )
+        result = await self._call(factory, idempotent)
+        return fan_out(result) if fan_out is not None else result
+
+    async def _call(self, factory, idempotent=True):
+        for attempt in range(self.retries + 1):
+            if not self.breaker.allow():
+                self.rejected += 1
+                raise UpstreamUnavailable(self.name, retry_after=self.breaker.retry_after())
+            await self.bucket.acquire()
+            self.calls += 1
+            try:
+                result = await factory()
+            except Exception as e:
+                last_attempt = attempt == self.retries
+                if getattr(e, "status", None) == 429:
+                    # The upstream is fine, it just wants us to slow down.
+                    self.breaker.record_success()
+                    retry_after = getattr(e, "retry_after", None)
+                    self.bucket.pause(float(retry_after) if retry_after else self.backoff(attempt))
+                elif self.is_server_error(e):
+                    self.breaker.record_failure()
+                    if not idempotent:
+                        raise
+                    if not last_attempt:
+                        await asyncio.sleep(self.backoff(attempt))
+                else:
+                    if isinstance(getattr(e, "status", None), int):
+                        # A client error (404 etc...) means the upstream works.
+                        self.breaker.record_success()
+                    raise
+                if last_attempt:
+                    raise
+                self.retried += 1
+                continue
+            self.breaker.record_success()
+            return result
@@ -0,0 +1,78 @@
+import asyncio
+from collections import Counter, OrderedDict
+
+
+class ViewRegistry:
+    """The paginator views that are currently alive, oldest first.
+
+    The size of a view is the number of entries (embeds or images) it holds. Once more than `max_views` views,
+    `max_per_user` views of the same user or `max_entries` entries overall are alive, the oldest views are stopped
+    early with `stop_paginator`, as if they had timed out."""
+
+    def __init__(self, *, max_views=2000, max_per_user=5, max_entries=50000):
+        self.max_views = max_views
+        self.max_per_user = max_per_user
+        self.max_entries = max_entries
+        # id(view) -> view, oldest first.
+        self._views = OrderedDict()
+        # user id -> {id(view): view}, oldest first.
+        self._by_user = {}
+        self.entries = 0
+        self.evicted = 0
+        # The pending `stop_paginator` tasks of the evicted views, referenced until they are done.
+        self._tasks = set()
+
+    def __len__(self):
+        return len(self._views)
+
+    @staticmethod
+    def size_of(view):
+        source = getattr(view, "source", None)
+        return len(source.entries) if source is not None else 0
+
+    def add(self, view):
+        if id(view) in self._views:
+            return
+        view.registry_size = self.size_of(view)
+        self._views[id(view)] = view
+        self._by_user.setdefault(view.main_interaction.user.id, OrderedDict())[id(view)] = view
+        self.entries += view.registry_size
+        self._enforce(view.main_interaction.user.id)
+
+    def remove(self, view):
+        if self._views.pop(id(view), None) is None:
+            return
+        self.entries -= view.registry_size
+        user_id = view.main_interaction.user.id
+        user_views = self._by_user.get(user_id)
+        if user_views is not None:
+            user_views.pop(id(view), None)
+            if not user_views:
+                del self._by_user[user_id]
+
+    def _evict(self, view):
+        self.remove(view)
+        self.evicted += 1
+        task = asyncio.create_task(view.stop_paginator(timed_out=True))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _enforce(self, user_id):
+        user_views = self._by_user.get(user_id)
+        while user_views and len(user_views) > self.max_per_user:
+            self._evict(next(iter(user_views.values())))
+        # Never evict the only view left, however big it is.
+        while len(self._views) > 1 and (len(self._views) > self.max_views or self.entries > self.max_entries):
+            self._evict(next(iter(self._views.values())))
+
+    def stats(self):
+        per_type = Counter()
+        for view in self._views.values():
+            per_type[type(view).__name__] += 1
+        return dict(
+            views=len(self._views),
+            users=len(self._by_user),
+            entries=self.entries,
+            evicted=self.evicted,
+            **per_type,
+        )
@@ -0,0 +1,142 @@
+import contextlib
+import json
+import logging
+import os
+import tempfile
+
+import aiohttp
+from waifuim import APIBaseURL
+
+log = logging.getLogger(__name__)
+
+OPENAPI_URL = APIBaseURL + "openapi.json"
+TAGS_URL = APIBaseURL + "tags"
+# The API version the waifuim client requests, the shape of the responses depends on it.
+API_VERSION = "v5"
+REQUEST_TIMEOUT = aiohttp.ClientTimeout(total=15)
+
+
+def client_headers(client):
+    """The headers `client` sends with its own requests."""
+    return {"User-Agent": f"aiohttp/{aiohttp.__version__}; {client.app_name}", "Accept-Version": API_VERSION}
+
+
+class WaifuImMetadata:
+    """The waifu.im tags and order_by values, refreshed with conditional requests.
+
+    The last good copy is always kept, swapped in one assignment when a new one is fetched and persisted to `path`
+    so a cold start without network still has the real values instead of the hardcoded fallbacks."""
+
+    def __init__(self, session, path="data/waifu_im.json", gateway=None, headers=None):
+        self.session = session
+        self.gateway = gateway
+        # Sent with every request, see `client_headers`.
+        self.headers = {"Accept-Version": API_VERSION, **(headers or {})}
+        self.path = path
+        self.tags = dict(sfw=['waifu'], nsfw=['waifu', 'ero'])
+        self.order_by = ["UPLOADED_AT", "FAVORITES"]
+        # url -> {"etag": ..., "last_modified": ...}
+        self.validators = {}
+        self.fresh = False
+        self.not_modified = 0
+        self.modified = 0
+
+    def load(self):
+        """Load the last copy saved on disk, if any."""
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+            tags, order_by = data["tags"], data["order_by"]
+            if not (isinstance(tags["sfw"], list) and isinstance(tags["nsfw"], list) and isinstance(order_by, list)):
+                raise TypeError("unexpected metadata shape")
+            validators = data.get("validators", {})
+            if not isinstance(validators, dict):
+                validators = {}
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            if not isinstance(e, FileNotFoundError):
+                log.warning(f"Ignoring the waifu.im metadata saved in {self.path}: {e!r}")
+            return False
+        self.tags = dict(sfw=tags["sfw"], nsfw=tags["nsfw"])
+        self.order_by = order_by
+        self.validators = validators
+        return True
+
+    def save(self):
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, exist_ok=True)
+        # A temporary file of its own, every cluster process saves the same path.
+        with tempfile.NamedTemporaryFile("w", dir=directory, prefix=os.path.basename(self.path) + ".",
+                                         suffix=".tmp", encoding="utf-8", delete=False) as f:
+            tmp = f.name
+            try:
+                json.dump(dict(tags=self.tags, order_by=self.order_by, validators=self.validators), f)
+            except BaseException:
+                f.close()
+                os.remove(tmp)
+                raise
+        try:
+            os.replace(tmp, self.path)
+        except OSError:
+            os.remove(tmp)
+            raise
+
+    async def _conditional_get(self, url):
+        """Return the JSON body of `url`, or None if it did not change since the last request."""
+        if self.gateway is not None:
+            return await self.gateway.call(lambda: self._get(url))
+        return await self._get(url)
+
+    async def _get(self, url):
+        headers = dict(self.headers)
+        validators = self.validators.get(url, {})
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("last_modified"):
+            headers["If-Modified-Since"] = validators["last_modified"]
+        async with self.session.get(url, headers=headers, timeout=REQUEST_TIMEOUT) as resp:
+            if self.gateway is not None:
+                self.gateway.bucket.update_from_headers(resp.headers)
+            if resp.status == 304:
+                self.not_modified += 1
+                return None
+            resp.raise_for_status()
+            data = await resp.json()
+            self.validators[url] = dict(etag=resp.headers.get("ETag"), last_modified=resp.headers.get("Last-Modified"))
+            self.modified += 1
+            return data
+
+    @contextlib.contextmanager
+    def _validated(self, url):
+        """Forget the validators of `url` if its body could not be used, so the next refresh downloads it again
+        instead of getting a 304 for it."""
+        try:
+            yield
+        except Exception:
+            self.validators.pop(url, None)
+            raise
+
+    async def refresh(self):
+        """Fetch the values that changed, returns whether anything new was swapped in."""
+        changed = False
+        try:
+            openapi = await self._conditional_get(OPENAPI_URL)
+            if openapi is not None:
+                with self._validated(OPENAPI_URL):
+                    self.order_by = openapi['components']['schemas']['OrderByType']['enum']
+                changed = True
+            raws = await self._conditional_get(TAGS_URL)
+            if raws is not None:
+                with self._validated(TAGS_URL):
+                    self.tags = dict(sfw=raws['versatile'], nsfw=raws['versatile'] + raws['nsfw'])
+                changed = True
+            self.fresh = True
+        finally:
+            if changed:
+                try:
+                    self.save()
+                except OSError as e:
+                    log.warning(f"Could not save the waifu.im metadata to {self.path}: {e}")
+        return changed
+
+    def stats(self):
+        return dict(fresh=self.fresh, modified=self.modified, not_modified=self.not_modified)